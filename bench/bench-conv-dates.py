@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark for moodle-conv-dates.py: converts a synthetic grading worksheet
+(100k rows by default) and reports the run time and peak memory, compared to
+the reference (read everything, then parse every date) algorithm.
+
+Invocation: bench-conv-dates.py [--rows N] [--dates N]
+"""
+
+import argparse
+import csv
+import os
+import os.path
+import runpy
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from bench_data import generate_worksheet
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONV_DATES = runpy.run_path(os.path.join(SCRIPTS_DIR, "moodle", "moodle-conv-dates.py"))
+
+def reference_convert(input_csv, output_csv, column_name=CONV_DATES["DEF_COLUMN_NAME"],
+                      format=CONV_DATES["DEF_DATE_FORMAT"]):
+    """ The original algorithm: reads all rows, then parses every date. """
+    date_col_idx = None
+    lines = []
+    with open(input_csv, newline='') as f:
+        for idx, line in enumerate(csv.reader(f)):
+            if idx == 0:
+                date_col_idx = line.index(column_name)
+                lines.append(line)
+                continue
+            date_str = line[date_col_idx].strip()
+            if date_str == "" or date_str == "-":
+                date_str = None
+            else:
+                date_str = datetime.strptime(date_str, format).strftime(
+                    CONV_DATES["OUT_DATE_FORMAT"])
+            line[date_col_idx] = date_str
+            lines.append(line)
+    with open(output_csv, "w") as out:
+        csv.writer(out).writerows(lines)
+
+
+def measure(name, func, *args, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("%-22s %8.1fms | peak memory %8.1f MB" % (name, elapsed * 1000, peak / 1024 / 1024))
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_csv = os.path.join(tmpdir, "worksheet.csv")
+        generate_worksheet(input_csv, args.rows, args.dates)
+        print("Synthetic worksheet: %d rows, %d distinct dates" % (args.rows, args.dates))
+        measure("reference", reference_convert, input_csv, os.path.join(tmpdir, "ref.csv"))
+        CONV_DATES["convert_date"].cache_clear()
+        measure("moodle-conv-dates", CONV_DATES["moodle_convert_csv_dates"],
+                input_csv, os.path.join(tmpdir, "out.csv"))
+        measure("... two date columns", CONV_DATES["moodle_convert_csv_dates"],
+                input_csv, os.path.join(tmpdir, "out2.csv"),
+                column_name=["Last modified (submission)", "Last modified (grade)"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="moodle-conv-dates.py benchmark")
+    parser.add_argument("--rows", type=int, default=100000, help="Number of worksheet rows")
+    parser.add_argument("--dates", type=int, default=50, help="Number of distinct submission dates")
+    main(parser.parse_args())
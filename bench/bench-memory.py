@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Memory benchmark for the gradebook cache: loads a large synthetic multi-sheet
+gradebook (50k rows x 200 columns by default) and renders its listing, then
+reports the peak memory / time compared to the reference representation (a
+dict per row, a list per row, remap_row() dicts built for each listed row).
+
+Invocation: bench-memory.py [--rows N] [--columns N] [--sheets N]
+"""
+
+import argparse
+import gc
+import json
+import os
+import os.path
+import runpy
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench_data import column_letter, generate_gradebook
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "gsheet"))
+GSHEET_TOOL = runpy.run_path(os.path.join(SCRIPTS_DIR, "gsheet", "gsheet-tool.py"))
+
+from gsheet_cache import open_cache
+
+LIST_FORMAT = "{a1_str} | {username} ({fullname})"
+
+
+def generate_cache(cache_file, rows, columns, sheets):
+    """ Writes a synthetic multi-sheet gradebook into the cache database. """
+    data = {"values": [], "meta": {}}
+    rows_per_sheet = rows // sheets
+    for sheet_idx in range(sheets):
+        sheet = "Grupa %d" % (sheet_idx + 1)
+        values = generate_gradebook(rows_per_sheet, columns, seed=sheet_idx)
+        data["meta"][sheet] = {
+            "obj": [sheet, ["A", 1], [column_letter(columns), rows_per_sheet + 1]],
+            "columnMap": GSHEET_TOOL["map_columns"](values[0], {
+                "fullname": "name", "username": "username", "_lab\\1": ["lab.*([0-9]+)"]}),
+            "header": values[0]}
+        for idx, row in enumerate(values[1:]):
+            data["values"].append({"row": row, "row_num": idx + 2, "parent_sheet": sheet})
+    open_cache(cache_file).replace(data)
+
+
+def reference_listing(cache_file):
+    """ The original representation: dict + list rows, eagerly remapped for the listing. """
+    conn = sqlite3.connect(cache_file)
+    meta = {sheet: json.loads(info) for sheet, info in conn.execute(
+        "SELECT sheet, info FROM meta ORDER BY pos")}
+    data = {"values": [], "meta": meta}
+    for sheet, row_num, row in conn.execute(
+            "SELECT r.sheet, r.row_num, r.row FROM rows r JOIN meta m ON m.sheet = r.sheet "
+            "ORDER BY m.pos, r.row_num"):
+        data["values"].append({"row": json.loads(row), "row_num": row_num, "parent_sheet": sheet})
+    lines = []
+    for obj in data["values"]:
+        sheet_info = meta[obj["parent_sheet"]]
+        rowObj = GSHEET_TOOL["remap_row"](obj["row"], sheet_info["columnMap"])
+        a1_str = GSHEET_TOOL["build_a1notation"]([sheet_info["obj"][0],
+                                                 (sheet_info["obj"][1][0], obj["row_num"])])
+        lines.append(LIST_FORMAT.format(row_num=obj["row_num"], a1_str=a1_str,
+                                        obj_str=str(rowObj), **rowObj))
+    conn.close()
+    return data, lines
+
+
+def current_listing(cache_file):
+    """ The current representation: compact cached rows, lazily remapped. """
+    cache = open_cache(cache_file)
+    cache._memo = None
+    data = cache.load()
+    lines = [GSHEET_TOOL["format_row"](LIST_FORMAT, obj, data["meta"][obj["parent_sheet"]])
+             for obj in data["values"]]
+    return data, lines
+
+
+def measure(name, func, *args):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("%-10s time %7.0fms | retained %7.1fMB | peak %7.1fMB" % (
+        name, elapsed * 1000, current / 2 ** 20, peak / 2 ** 20))
+    return result
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cache_file = os.path.join(tmpdir, ".cache.db")
+        generate_cache(cache_file, args.rows, args.columns, args.sheets)
+        print("Synthetic gradebook: %d rows x %d columns in %d sheets" % (
+            args.rows, args.columns, args.sheets))
+        ref = measure("reference", reference_listing, cache_file)
+        cur = measure("current", current_listing, cache_file)
+        if ref[1] != cur[1]:
+            print("ERROR: the listings differ!")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gradebook cache memory benchmark")
+    parser.add_argument("--rows", type=int, default=50000, help="Number of gradebook rows")
+    parser.add_argument("--columns", type=int, default=200, help="Number of gradebook columns")
+    parser.add_argument("--sheets", type=int, default=10, help="Number of sheets")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for gsheet-tool.py: measures the end-to-end wall time of the
+cached listing (`fetch_data --cached`, as piped into fzf by the gradebook TUI)
+using a synthetic gradebook cache (no network / authentication needed).
+
+Invocation: bench-startup.py [--rows N] [--columns N] [--runs N]
+"""
+
+import argparse
+import os
+import os.path
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GSHEET_TOOL = os.path.join(SCRIPTS_DIR, "gsheet", "gsheet-tool.py")
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "gsheet"))
+
+from bench_data import column_letter, generate_gradebook
+from gsheet_cache import open_cache
+
+CONFIG = """
+google_auth:
+  token: "{dir}/token.json"
+google_sheets:
+  id: "benchmark"
+  cache: "{dir}/.cache.db"
+  sheetRanges: ["Catalog!A1:{last_col}{last_row}"]
+  columnPatterns:
+    fullname: 'name'
+    username: 'username'
+    "_lab\\\\1": ["lab.*([0-9]+)"]
+  listFormat: "{{a1_str}} | {{username}} ({{fullname}})"
+"""
+
+
+def generate_cache(cache_file, rows, columns):
+    """ Writes a synthetic gradebook into the cache database. """
+    gradebook = generate_gradebook(rows, columns)
+    header = gradebook[0]
+    last_col = column_letter(columns)
+    sheet_info = {"obj": ["Catalog", ["A", 1], [last_col, rows + 1]],
+                  "columnMap": {"fullname": 0, "username": 1,
+                                **{"lab%d" % i: i + 1 for i in range(1, columns - 1)}},
+                  "header": header}
+    values = [{"row": row, "row_num": idx + 2, "parent_sheet": "Catalog"}
+              for idx, row in enumerate(gradebook[1:])]
+    open_cache(cache_file).replace({"values": values, "meta": {"Catalog": sheet_info}})
+    return last_col
+
+
+def time_command(cmd, runs, cwd):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings):
+    print("%-28s min %7.1fms | median %7.1fms | mean %7.1fms" % (
+        name, min(timings) * 1000, statistics.median(timings) * 1000,
+        statistics.mean(timings) * 1000))
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        last_col = generate_cache(os.path.join(tmpdir, ".cache.db"), args.rows, args.columns)
+        with open(os.path.join(tmpdir, "grading-config.yaml"), "w") as f:
+            f.write(CONFIG.format(dir=tmpdir, last_col=last_col, last_row=args.rows + 1))
+        print("Synthetic gradebook: %d rows x %d columns, %d runs" % (
+            args.rows, args.columns, args.runs))
+        report("python (interpreter only)",
+               time_command([sys.executable, "-c", "pass"], args.runs, tmpdir))
+        report("fetch_data --cached",
+               time_command([sys.executable, GSHEET_TOOL, "fetch_data", "--cached"],
+                            args.runs, tmpdir))
+        report("fetch_data --filter-range",
+               time_command([sys.executable, GSHEET_TOOL, "fetch_data", "--cached",
+                             "--filter-range", "Catalog!A%d" % (args.rows // 2 + 2)],
+                            args.runs, tmpdir))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="gsheet-tool.py startup benchmark")
+    parser.add_argument("--rows", type=int, default=600, help="Number of gradebook rows")
+    parser.add_argument("--columns", type=int, default=30, help="Number of gradebook columns")
+    parser.add_argument("--runs", type=int, default=10, help="Number of runs per command")
+    main(parser.parse_args())
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite: runs the gsheet-tool.py commands (against a local Sheets API
+stand-in, see fake_sheets.py) and the Moodle scripts on synthetic data, then
+reports the latency percentiles, throughput and peak memory of each operation.
+
+Results can be saved as a baseline (`--save-baseline FILE`) and later runs
+compared against it (`--baseline FILE`): operations slower / larger than the
+threshold are reported as regressions (and the exit code is 1).
+
+Invocation: bench-suite.py [--sizes ROWSxCOLS,...] [--runs N] [--latency MS]
+                           [--fail-rate P] [--only NAME] [--baseline FILE]
+"""
+
+import argparse
+import json
+import os
+import os.path
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_data import (column_letter, generate_gradebook, generate_submissions,
+                        generate_worksheet)
+from fake_sheets import VERSION_SHEET, FakeSheets, start_server
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GSHEET_TOOL = os.path.join(SCRIPTS_DIR, "gsheet", "gsheet-tool.py")
+MOODLE_SUB_TOOL = os.path.join(SCRIPTS_DIR, "moodle", "moodle-sub-tool.py")
+MOODLE_CONV_DATES = os.path.join(SCRIPTS_DIR, "moodle", "moodle-conv-dates.py")
+
+PRESETS = {
+    "quick": "100x10,1000x30",
+    "full": "100x10,1000x50,10000x100,50000x20,2000x500",
+}
+
+CONFIG = """
+google_auth:
+  anonymous: true
+google_sheets:
+  id: "benchmark"
+  cache: "{dir}/.cache.db"
+  sheetRanges: ["Catalog!A1:{last_col}{last_row}"]
+  columnPatterns:
+    fullname: 'name'
+    username: 'username'
+    "_lab\\\\1": ["lab.*([0-9]+)"]
+  listFormat: "{{a1_str}} | {{username}} ({{fullname}})"
+  changeCheckRange: "{version_sheet}!A1"
+  api:
+    endpoint: "http://127.0.0.1:{port}/"
+    requestsPerMinute: 100000
+"""
+
+
+class CommandFailed(Exception):
+    pass
+
+
+# Runs the measured command in a grandchild process: on Linux, a child's peak
+# RSS (ru_maxrss) starts from its parent's RSS at fork time, so the (much
+# larger) benchmark process must not be the direct parent.
+LAUNCHER = """
+import os, sys, time
+start = time.perf_counter()
+pid = os.fork()
+if pid == 0:
+    os.execv(sys.argv[2], sys.argv[2:])
+_, status, rusage = os.wait4(pid, 0)
+with open(sys.argv[1], "w") as f:
+    f.write("%f %d" % (time.perf_counter() - start, rusage.ru_maxrss))
+sys.exit(os.waitstatus_to_exitcode(status))
+"""
+
+
+def run_measured(cmd, cwd):
+    """ Runs a command; returns its (wall time, peak RSS in MB). """
+    with tempfile.TemporaryFile() as err, tempfile.NamedTemporaryFile("r") as stats:
+        proc = subprocess.run([sys.executable, "-S", "-c", LAUNCHER, stats.name] + cmd,
+                              cwd=cwd, stdout=subprocess.DEVNULL, stderr=err)
+        if proc.returncode != 0:
+            err.seek(0)
+            raise CommandFailed("%s: exit code %d\n%s" % (
+                " ".join(cmd), proc.returncode, err.read().decode(errors="replace")))
+        elapsed, maxrss = stats.read().split()
+    # ru_maxrss is in KB on Linux (bytes on macOS)
+    return float(elapsed), int(maxrss) / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def percentile(sorted_values, pct):
+    """ Nearest-rank percentile of an (already sorted) list. """
+    idx = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[idx]
+
+
+def measure(name, cmd, cwd, runs, items, setup=None):
+    """ Runs an operation `runs` times and returns its result summary. """
+    timings, peaks = [], []
+    for _ in range(runs):
+        if setup:
+            setup()
+        elapsed, peak = run_measured(cmd, cwd)
+        timings.append(elapsed)
+        peaks.append(peak)
+    timings.sort()
+    return {"name": name, "runs": runs, "items": items,
+            "p50": percentile(timings, 50), "p90": percentile(timings, 90),
+            "p99": percentile(timings, 99), "max": timings[-1],
+            "throughput": items / percentile(timings, 50), "peak_mb": max(peaks)}
+
+
+def report(result, baseline=None, threshold=0.2):
+    """ Prints a result line (and its comparison to the baseline); returns True on regression. """
+    print("%-36s p50 %8.1fms  p90 %8.1fms  p99 %8.1fms | %10.0f items/s | peak %6.1fMB" % (
+        result["name"], result["p50"] * 1000, result["p90"] * 1000, result["p99"] * 1000,
+        result["throughput"], result["peak_mb"]))
+    base = (baseline or {}).get(result["name"])
+    if not base:
+        return False
+    time_delta = result["p50"] / base["p50"] - 1
+    mem_delta = result["peak_mb"] / base["peak_mb"] - 1
+    regression = time_delta > threshold or mem_delta > threshold
+    print("%-36s p50 %+7.1f%%  peak %+7.1f%%%s" % (
+        "  vs. baseline", time_delta * 100, mem_delta * 100, "  REGRESSION" if regression else ""))
+    return regression
+
+
+def gsheet_operations(args, workdir, port, state, rows, columns):
+    """ Yields the gsheet-tool.py benchmarks for a gradebook size. """
+    size = "%dx%d" % (rows, columns)
+    last_col = column_letter(columns)
+    state.sheets.clear()
+    state.sheets["Catalog"] = generate_gradebook(rows, columns)
+    with open(os.path.join(workdir, "grading-config.yaml"), "w") as f:
+        f.write(CONFIG.format(dir=workdir, last_col=last_col, last_row=rows + 1, port=port,
+                              version_sheet=VERSION_SHEET))
+    tool = [sys.executable, GSHEET_TOOL]
+    yield measure("fetch_data --full [%s]" % size, tool + ["fetch_data", "--full"],
+                  workdir, args.runs, rows)
+    yield measure("fetch_data (unchanged) [%s]" % size, tool + ["fetch_data"],
+                  workdir, args.runs, rows)
+    yield measure("fetch_data --cached [%s]" % size, tool + ["fetch_data", "--cached"],
+                  workdir, args.runs, rows)
+    yield measure("fetch_data --filter-range [%s]" % size,
+                  tool + ["fetch_data", "--cached", "--filter-range", "Catalog!A%d" % (rows // 2 + 2)],
+                  workdir, args.runs, 1)
+    yield measure("update [%s]" % size,
+                  tool + ["update", "--no-queue", "--a1", "Catalog!A%d" % (rows // 2 + 2),
+                          "--value", "lab1=10"], workdir, args.runs, 1)
+
+
+def moodle_operations(args, workdir):
+    """ Yields the Moodle scripts' benchmarks. """
+    worksheet = os.path.join(workdir, "worksheet.csv")
+    generate_worksheet(worksheet, args.worksheet_rows)
+    yield measure("moodle-conv-dates [%d]" % args.worksheet_rows,
+                  [sys.executable, MOODLE_CONV_DATES, worksheet, os.path.join(workdir, "out.csv")],
+                  workdir, args.runs, args.worksheet_rows)
+
+    template = os.path.join(workdir, "submissions.template")
+    subs_dir = os.path.join(workdir, "submissions")
+    generate_submissions(template, args.submissions)
+    generate_worksheet(worksheet, args.submissions)
+
+    def copy_submissions():
+        shutil.rmtree(subs_dir, ignore_errors=True)
+        shutil.copytree(template, subs_dir)
+
+    for jobs in sorted({1, args.jobs}):
+        yield measure("moodle-sub-tool -x -j%d [%d]" % (jobs, args.submissions),
+                      [sys.executable, MOODLE_SUB_TOOL, "-w", worksheet, "-r", "username",
+                       "-x", "-j", str(jobs), subs_dir],
+                      workdir, args.runs, args.submissions, setup=copy_submissions)
+
+
+def parse_sizes(sizes):
+    result = []
+    for size in PRESETS.get(sizes, sizes).split(","):
+        rows, _, columns = size.partition("x")
+        result.append((int(rows), max(3, int(columns or 10))))
+    return result
+
+
+def main(args):
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    state = FakeSheets(latency=args.latency / 1000, jitter=args.jitter / 1000,
+                       fail_rate=args.fail_rate)
+    server = start_server(state)
+    port = server.server_address[1]
+    print("%d runs per operation, fake API latency %.0fms (+/- %.0fms), 429 rate %.0f%%" % (
+        args.runs, args.latency, args.jitter, args.fail_rate * 100))
+    results = []
+    regressions = 0
+    with tempfile.TemporaryDirectory() as workdir:
+        benchmarks = []
+        if args.only in (None, "gsheet"):
+            for rows, columns in parse_sizes(args.sizes):
+                benchmarks.append(lambda rows=rows, columns=columns: gsheet_operations(
+                    args, workdir, port, state, rows, columns))
+        if args.only in (None, "moodle"):
+            benchmarks.append(lambda: moodle_operations(args, workdir))
+        for benchmark in benchmarks:
+            for result in benchmark():
+                results.append(result)
+                regressions += report(result, baseline, args.threshold)
+    server.shutdown()
+    print("fake API: %(requests)d requests (%(failed)d failed with 429), "
+          "%(cells_read)d cells read, %(cells_written)d written" % state.stats)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.node(),
+                       "time": time.time(), "results": {r["name"]: r for r in results}},
+                      f, indent=1)
+        print("Baseline saved to '%s'" % (args.save_baseline,))
+    if regressions:
+        print("%d regression(s) over %.0f%%!" % (regressions, args.threshold * 100))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="grading-helpers benchmark suite")
+    parser.add_argument("--sizes", default="quick",
+                        help="Gradebook sizes as ROWSxCOLUMNS list, or a preset (%s)" %
+                        (", ".join(PRESETS),))
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs per operation")
+    parser.add_argument("--only", choices=["gsheet", "moodle"], help="Only run these benchmarks")
+    parser.add_argument("--latency", type=float, default=20.0,
+                        help="Fake API latency per request (ms, default: 20)")
+    parser.add_argument("--jitter", type=float, default=5.0, help="Fake API latency jitter (ms)")
+    parser.add_argument("--fail-rate", type=float, default=0.0,
+                        help="Probability of the fake API answering with 429 (0..1)")
+    parser.add_argument("--worksheet-rows", type=int, default=20000,
+                        help="Rows of the Moodle worksheet to convert")
+    parser.add_argument("--submissions", type=int, default=100,
+                        help="Number of (archived) submissions to extract")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Parallel extraction jobs to compare with the serial run")
+    parser.add_argument("--baseline", help="Compare the results with this baseline file")
+    parser.add_argument("--save-baseline", help="Save the results as baseline to this file")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative slowdown / memory growth reported as regression (default: 0.2)")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,87 @@
+"""
+Synthetic data generators for the benchmarks: gradebooks, Moodle grading
+worksheets and submission trees (Moodle's "Download all submissions" layout).
+"""
+
+import csv
+import io
+import os
+import os.path
+import random
+import zipfile
+from datetime import datetime, timedelta
+
+MOODLE_DATE_FORMAT = "%A, %d %B %Y, %I:%M %p"
+WORKSHEET_HEADER = ["Identifier", "Full name", "Email address", "Status", "Grade",
+                    "Last modified (submission)", "Last modified (grade)", "Feedback comments"]
+
+
+def column_letter(column):
+    letter = ''
+    while column > 0:
+        temp = (column - 1) % 26
+        letter = chr(temp + 65) + letter
+        column = (column - temp - 1) // 26
+    return letter
+
+
+def generate_gradebook(rows, columns, seed=0):
+    """
+    Returns a synthetic gradebook sheet (list of rows, including the header):
+    name, username, then lab grades.
+    """
+    rnd = random.Random(seed)
+    header = ["Name", "Username"] + ["Lab %d" % i for i in range(1, columns - 1)]
+    values = [header]
+    for idx in range(rows):
+        values.append(["Student Ștefan %d" % idx, "user%d" % idx] +
+                      [str(rnd.randint(0, 10)) for _ in range(columns - 2)])
+    return values
+
+
+def generate_worksheet(filename, rows, distinct_dates=500, seed=0):
+    """ Writes a synthetic Moodle grading worksheet (dates clustered near a deadline). """
+    rnd = random.Random(seed)
+    deadline = datetime(2024, 5, 26, 23, 59)
+    dates = [(deadline - timedelta(minutes=rnd.randint(-2 * 24 * 60, 7 * 24 * 60)))
+             .strftime(MOODLE_DATE_FORMAT) for _ in range(distinct_dates)]
+    with open(filename, "w", newline='') as f:
+        csvw = csv.writer(f)
+        csvw.writerow(WORKSHEET_HEADER)
+        for idx in range(rows):
+            csvw.writerow(["Participant %d" % idx, "Student Ștefan %d" % idx,
+                           "user%d@example.com" % idx, "Submitted", "",
+                           rnd.choice(dates), "-", ""])
+
+
+def build_archive(files, file_size, rnd):
+    """ Returns the bytes of a zip archive with a single top-level directory. """
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for idx in range(files):
+            # half random (incompressible), half text
+            content = rnd.randbytes(file_size // 2) + b"int main() { return 0; }\n" * (
+                file_size // 50)
+            zf.writestr("solution/src/file%d.c" % idx, content)
+    return buf.getvalue()
+
+
+def generate_submissions(dest_dir, count, files=10, file_size=4096, duplicates=0.1, seed=0):
+    """
+    Creates a submissions directory: one '<Full Name>_<ID>_assignsubmission_file_'
+    directory per student, each holding an archive (a fraction of them are
+    identical copies of another submission).
+    """
+    rnd = random.Random(seed)
+    os.makedirs(dest_dir, exist_ok=True)
+    archives = []
+    for idx in range(count):
+        if archives and rnd.random() < duplicates:
+            data = rnd.choice(archives)
+        else:
+            data = build_archive(files, file_size, rnd)
+            archives.append(data)
+        sub_dir = os.path.join(dest_dir, "Student Ștefan %d_%d_assignsubmission_file_" % (idx, idx))
+        os.makedirs(sub_dir, exist_ok=True)
+        with open(os.path.join(sub_dir, "solution.zip"), "wb") as f:
+            f.write(data)
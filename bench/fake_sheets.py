@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Google Sheets API (values.get / values:batchGet /
+values:batchUpdate only), with configurable latency and 429 (quota) error
+injection. Used by the benchmarks, but can also be started standalone for
+manually testing gsheet-tool.py (use `anonymous: true` auth + `api.endpoint`).
+
+Invocation: fake_sheets.py [--port N] [--rows N] [--columns N] [--latency MS] [--fail-rate P]
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench_data import generate_gradebook
+
+RANGE_RE = re.compile(r"^([A-Z]+)?([0-9]+)?$")
+# virtual sheet whose A1 cell holds the spreadsheet's version (incremented on
+# each write), usable as gsheet-tool.py's `changeCheckRange`
+VERSION_SHEET = "_version"
+
+
+def column_index(letters):
+    idx = 0
+    for ch in letters:
+        idx = idx * 26 + ord(ch) - 64
+    return idx
+
+
+def parse_range(range_str):
+    """ Parses an A1 range into (sheet, first col, first row, last col, last row) (1-based). """
+    sheet, sep, cells = range_str.rpartition("!")
+    if not sep:  # just the sheet name
+        sheet, cells = cells, ""
+    sheet = sheet.strip("'")
+    parts = [RANGE_RE.match(part) for part in cells.split(":")] if cells else []
+    if not parts:
+        return sheet, 1, 1, 10 ** 6, 10 ** 7
+    first, last = parts[0], parts[-1]
+    return (sheet, column_index(first.group(1) or "A"), int(first.group(2) or 1),
+            column_index(last.group(1)) if last.group(1) else 10 ** 6,
+            int(last.group(2)) if last.group(2) else 10 ** 7)
+
+
+class FakeSheets:
+    """
+    The fake spreadsheet's state (sheets as lists of rows, plus a version
+    number, see VERSION_SHEET) and its behavior.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, fail_rate=0.0, seed=0):
+        self.sheets = {}
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.version = 1
+        self.stats = {"requests": 0, "failed": 0, "cells_read": 0, "cells_written": 0}
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] += value
+
+    def get_values(self, range_str):
+        sheet, c1, r1, c2, r2 = parse_range(range_str)
+        rows = self.sheets.get(sheet, [])
+        if sheet == VERSION_SHEET:
+            rows = [[str(self.version)]]
+        values = []
+        for row in rows[r1 - 1:min(r2, len(rows))]:
+            row = row[c1 - 1:c2]
+            while row and row[-1] == "":
+                row = row[:-1]
+            values.append(row)
+        while values and not values[-1]:
+            values.pop()
+        self.count("cells_read", sum(len(row) for row in values))
+        return {"range": range_str, "majorDimension": "ROWS", "values": values}
+
+    def set_values(self, range_str, values):
+        sheet, c1, r1, _, _ = parse_range(range_str)
+        with self.lock:
+            self.version += 1
+            rows = self.sheets.setdefault(sheet, [])
+            for ri, row_values in enumerate(values):
+                while len(rows) < r1 + ri:
+                    rows.append([])
+                row = rows[r1 + ri - 1]
+                for ci, value in enumerate(row_values):
+                    while len(row) < c1 + ci:
+                        row.append("")
+                    row[c1 + ci - 1] = str(value)
+                self.stats["cells_written"] += len(row_values)
+
+    def should_fail(self):
+        with self.lock:
+            self.stats["requests"] += 1
+            if self.fail_rate and self.random.random() < self.fail_rate:
+                self.stats["failed"] += 1
+                return True
+        return False
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+
+
+def make_handler(state):
+    class FakeSheetsHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, obj, code=200):
+            body = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def handle_api(self, fn):
+            state.delay()
+            if state.should_fail():
+                return self.send_json({"error": {"code": 429, "status": "RESOURCE_EXHAUSTED",
+                                                 "message": "Quota exceeded (injected)"}}, 429)
+            try:
+                self.send_json(fn())
+            except (KeyError, ValueError, AttributeError) as e:
+                self.send_json({"error": {"code": 400, "message": str(e)}}, 400)
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            query = urllib.parse.parse_qs(url.query)
+            if url.path.endswith("/values:batchGet"):
+                return self.handle_api(lambda: {"valueRanges": [
+                    state.get_values(range_str) for range_str in query.get("ranges", [])]})
+            match = re.search(r"/values/(.+)$", url.path)
+            if not match:
+                return self.send_json({"error": {"code": 404, "message": "Not found"}}, 404)
+            return self.handle_api(lambda: state.get_values(urllib.parse.unquote(match.group(1))))
+
+        def do_POST(self):
+            url = urllib.parse.urlparse(self.path)
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not url.path.endswith("/values:batchUpdate"):
+                return self.send_json({"error": {"code": 404, "message": "Not found"}}, 404)
+
+            def batch_update():
+                for entry in body["data"]:
+                    state.set_values(entry["range"], entry["values"])
+                return {"totalUpdatedRanges": len(body["data"])}
+            return self.handle_api(batch_update)
+
+    return FakeSheetsHandler
+
+
+def start_server(state, port=0):
+    """ Starts the fake API server in a background thread; returns the server object. """
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Sheets API stand-in")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (localhost)")
+    parser.add_argument("--rows", type=int, default=100, help="Rows of the synthetic 'Catalog' sheet")
+    parser.add_argument("--columns", type=int, default=10, help="Columns of the synthetic sheet")
+    parser.add_argument("--latency", type=float, default=0.0, help="Added latency per request (ms)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random latency jitter (+/- ms)")
+    parser.add_argument("--fail-rate", type=float, default=0.0,
+                        help="Probability of answering with a 429 error (0..1)")
+    args = parser.parse_args()
+    state = FakeSheets(latency=args.latency / 1000, jitter=args.jitter / 1000,
+                       fail_rate=args.fail_rate)
+    state.sheets["Catalog"] = generate_gradebook(args.rows, args.columns)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(state))
+    print("Serving the fake Sheets API on http://127.0.0.1:%d/" % (args.port,))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
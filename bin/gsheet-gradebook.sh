@@ -15,11 +15,16 @@ source "$_GRADING_SCRIPTS_DIR/shell/interactive_menu.sh"
 # parse arguments (TODO: add help msg)
 FZF="${FZF:-fzf}"
 NO_FETCH=
+NO_SERVER=
 GSHEET_TOOL="$_GRADING_SCRIPTS_DIR/gsheet/gsheet-tool.py"
+GSHEET_CLIENT="$_GRADING_SCRIPTS_DIR/gsheet/gsheet-client.py"
+GSHEET_SOCKET="${GSHEET_SOCKET:-$(pwd)/.gsheet-tool.sock}"
 while [[ "$#" -gt 0 ]]; do
     case "$1" in
         -n|--no-fetch)
             NO_FETCH=1 ;;
+        --no-server)
+            NO_SERVER=1 ;;
     esac; shift
 done
 
@@ -33,8 +38,32 @@ INTERACTIVE_COMMANDS+=(
     [refresh]=cmd_refresh [r]='!refresh'
     [update]=cmd_update_cell [set]='!update' [u]='!update'
     [metadata]=cmd_get_metadata
+    [pending]=cmd_pending [flush]=cmd_flush
 )
 
+# Runs a gsheet-tool command (through the background server, if started)
+function gsheet_tool() {
+    if [[ -n "$NO_SERVER" ]]; then
+        "$GSHEET_TOOL" "$@"
+    else
+        "$GSHEET_CLIENT" --socket "$GSHEET_SOCKET" "$@"
+    fi
+}
+
+# Starts the gsheet-tool server (keeps auth / API / cache warm between commands)
+function start_gsheet_server() {
+    [[ -z "$NO_SERVER" ]] || return 0
+    "$GSHEET_TOOL" serve --socket "$GSHEET_SOCKET" --parent-pid "$$" \
+        --log "${GSHEET_SOCKET%.sock}.log" &
+    local i=
+    for (( i=0; i<100; i++ )); do
+        [[ ! -S "$GSHEET_SOCKET" ]] || return 0
+        sleep 0.1
+    done
+    echo "WARNING: gsheet-tool server did not start, running in standalone mode!" >&2
+}
+
+# Note: runs standalone (before the server starts), as it may need to authenticate
 function refresh_spreadsheet() {
     "$GSHEET_TOOL" fetch_data
 }
@@ -49,17 +78,23 @@ function cmd_update_cell() {
     for arg in "$@"; do
         _ARGS+=(--value "$arg")
     done
-    "$GSHEET_TOOL" update --a1 "$S_ROW_A1" "${_ARGS[@]}"
+    gsheet_tool update --a1 "$S_ROW_A1" "${_ARGS[@]}"
 }
 # Shows info about current range
 function cmd_show_info() {
-    "$GSHEET_TOOL" fetch_data --cached --filter-range "$S_ROW_A1"
+    gsheet_tool fetch_data --cached --filter-range "$S_ROW_A1"
 }
 function cmd_get_metadata() {
-    "$GSHEET_TOOL" get_metadata
+    gsheet_tool get_metadata
+}
+function cmd_pending() {
+    gsheet_tool pending
+}
+function cmd_flush() {
+    gsheet_tool flush
 }
 function cmd_refresh() {
-    "$GSHEET_TOOL" fetch_data --filter-range "$S_ROW_A1"
+    gsheet_tool fetch_data --incremental --filter-range "$S_ROW_A1"
 }
 
 function grading_menu_help() {
@@ -72,9 +107,16 @@ function grading_menu_help() {
 # Displays the FZF chooser menu
 function chooser_menu() {
     local _OPTION=
-    _OPTION="$("$GSHEET_TOOL" fetch_data --cached | $FZF)"
+    if [[ -n "$LISTING_FILE" && -f "$LISTING_FILE" ]]; then
+        # pre-rendered listing, kept in sync with the cache by gsheet-tool
+        _OPTION="$($FZF < "$LISTING_FILE")"
+    else
+        _OPTION="$(gsheet_tool fetch_data --cached | $FZF)"
+    fi
     if [[ -z "$_OPTION" ]]; then
-        echo "No choice! Exiting..." >&2; exit 0
+        echo "No choice! Exiting..." >&2
+        gsheet_tool flush >/dev/null || true
+        exit 0
     fi
     grading_select_row "${_OPTION%%*( )"|"*}"
 }
@@ -93,6 +135,8 @@ function grading_menu() {
 
 # gradebook entry selected, show interactive menu
 [[ "$NO_FETCH" == "1" ]] || refresh_spreadsheet
+start_gsheet_server
+LISTING_FILE="$(gsheet_tool listing_file)" || LISTING_FILE=
 
 # enable interactive menu history
 read_hist_init "$(pwd)/.grading_history"
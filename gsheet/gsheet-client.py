@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# Thin client for a running `gsheet-tool.py serve` instance.
+# Forwards the command line arguments to the server and prints its output
+# (falls back to running gsheet-tool.py directly when no server is listening).
+# The commands reading stdin (e.g., `search` batch mode) get it forwarded.
+#
+# Usage: gsheet-client.py [--socket PATH] COMMAND [ARGS...]
+
+import json
+import os
+import os.path
+import socket
+import sys
+
+SOCKET_FILE = ".gsheet-tool.sock"
+
+
+def send_request(socket_path, request):
+    """ Sends the request to the server and returns its decoded response. """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(socket_path)
+        s.sendall(json.dumps(request).encode() + b"\n")
+        with s.makefile("rb") as f:
+            return json.loads(f.readline())
+
+
+def main(argv):
+    socket_path = os.environ.get("GSHEET_SOCKET", SOCKET_FILE)
+    if len(argv) >= 2 and argv[0] == "--socket":
+        socket_path = argv[1]
+        argv = argv[2:]
+    try:
+        response = send_request(socket_path, {"argv": argv})
+        if response.get("need_stdin"):
+            # only read when actually needed (stdin may be an idle terminal)
+            response = send_request(socket_path, {"argv": argv, "stdin": sys.stdin.read()})
+    except (FileNotFoundError, ConnectionRefusedError):
+        tool = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gsheet-tool.py")
+        os.execv(sys.executable, [sys.executable, tool] + argv)
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    return response["code"]
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
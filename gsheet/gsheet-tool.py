@@ -2,25 +2,49 @@
 # Google Sheets-based simple retrieve / set CLI utility.
 # Allows fetching ranges and setting specific cells using Google Sheets API.
 
+import time
+_script_start = time.perf_counter()  # for --profile
+
 import argparse
+import contextlib
+import csv
+import hashlib
+import io
 import math
 import yaml
 import json
+import socket
+import socketserver
 import stat
 import os
 import os.path
 import re
+import sys
+import traceback
+import urllib.parse
+from collections.abc import Mapping
+from datetime import datetime
+
+import gsheet_profile as profile
+from gsheet_cache import INDEXED_COLUMNS, CachedRow, open_cache
+from gsheet_requests import RequestScheduler
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google.oauth2 import service_account
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+# note: the Google API modules are slow to load, so they are only imported
+# when a command actually needs the network (see auth_credentials)
 
 CONFIG_FILE = "grading-config.yaml"
 CACHE_FILE = ".index.csv"
+SOCKET_FILE = ".gsheet-tool.sock"
+# batchGet request limits (ranges are sent inside the URL's query string)
+MAX_BATCH_RANGES = 100
+MAX_BATCH_URL_CHARS = 4000
+# max. number of ranges to send inside a single batchUpdate request
+MAX_UPDATE_RANGES = 1000
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+# Moodle grading worksheet dates (as exported / converted by moodle-conv-dates.py)
+MOODLE_DATE_FORMATS = ("%A, %d %B %Y, %I:%M %p", "%Y-%m-%d %H:%M")
+MOODLE_DATE_COLUMNS = ("Last modified (submission)", "Last modified (grade)")
+MOODLE_SUBMISSION_DATE_COLUMN = "Last modified (submission)"
 
 
 def parse_sheet_range(range_str):
@@ -54,6 +78,27 @@ def remap_row(row, columnMap):
         obj[name] = row[idx].strip()
     return obj
 
+class RemappedRow(Mapping):
+    """ Lazy remap_row(): the values are only looked up (and stripped) on access. """
+
+    __slots__ = ("row", "columnMap")
+
+    def __init__(self, row, columnMap):
+        self.row = row
+        self.columnMap = columnMap
+
+    def __getitem__(self, name):
+        idx = self.columnMap[name]
+        if idx >= len(self.row):
+            raise KeyError(name)
+        return self.row[idx].strip()
+
+    def __iter__(self):
+        return (name for name, idx in self.columnMap.items() if idx < len(self.row))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
 def column_letter_to_idx(letter):
     column = 0
     for idx, c in enumerate(letter):
@@ -70,7 +115,16 @@ def column_idx_to_letter(column):
 
 def auth_credentials(authConfig):
     """ Returns authentication object for Google Sheets. """
+    with profile.phase("imports"):
+        from google.auth.transport.requests import Request
+        from google.oauth2.credentials import Credentials
+        from google.oauth2 import service_account
+        from google_auth_oauthlib.flow import InstalledAppFlow
     creds = None
+    if authConfig.get("anonymous"):
+        # no authentication (e.g., for a local Sheets API stand-in)
+        from google.auth.credentials import AnonymousCredentials
+        return AnonymousCredentials()
     if "serviceAccount" in authConfig and authConfig["serviceAccount"]:
         # use a service account for auth
         saFile = os.path.expanduser(authConfig["serviceAccount"])
@@ -95,133 +149,492 @@ def auth_credentials(authConfig):
                 os.chmod(tokenFile, stat.S_IRUSR | stat.S_IWUSR)
     return creds
 
+class LazyCredentials:
+    """ Authenticates using auth_credentials() on first use only. """
+
+    def __init__(self, authConfig):
+        self.authConfig = authConfig
+        self._creds = None
+
+    def get(self):
+        if self._creds is None:
+            with profile.phase("auth"):
+                self._creds = auth_credentials(self.authConfig)
+        return self._creds
+
+_api_config = {}
+_sheets_service = None
+_scheduler = None
+
+def configure_api(apiCfg):
+    """ Sets the Sheets API request options (see the `api` config section). """
+    global _api_config, _sheets_service, _scheduler
+    _api_config = apiCfg or {}
+    _sheets_service = _scheduler = None
+
+def get_sheets_service(creds):
+    """ Returns the Sheets API service object (built once per credentials). """
+    global _sheets_service
+    if not _sheets_service or _sheets_service[0] is not creds:
+        with profile.phase("imports"):
+            from googleapiclient.discovery import build
+        client_options = None
+        if _api_config.get("endpoint"):
+            client_options = {"api_endpoint": _api_config["endpoint"]}
+        credentials = creds.get()
+        with profile.phase("discovery"):
+            _sheets_service = (creds, build("sheets", "v4", credentials=credentials,
+                                            client_options=client_options))
+    return _sheets_service[1]
+
+def get_scheduler(creds):
+    """ Returns the request scheduler all Sheets API calls must go through. """
+    global _scheduler
+    if not _scheduler or _scheduler[0] is not creds:
+        with profile.phase("imports"):
+            import httplib2
+            import google_auth_httplib2
+
+        def http_factory():
+            http = google_auth_httplib2.AuthorizedHttp(
+                creds.get(), http=httplib2.Http(timeout=_api_config.get("timeout", 60)))
+            return profile.CountingHttp(http) if profile.is_enabled() else http
+
+        _scheduler = (creds, RequestScheduler(
+            requests_per_minute=_api_config.get("requestsPerMinute", 60),
+            max_retries=_api_config.get("maxRetries", 5),
+            max_concurrency=_api_config.get("maxConcurrency", 2),
+            http_factory=http_factory))
+    return _scheduler[1]
+
 def get_spreadsheet(creds, spreadsheet_id, range_str):
     """ Returns the requested Spreadsheet object. """
-    service = build("sheets", "v4", credentials=creds)
-    spreadsheet = (
-        service.spreadsheets()
-        .values()
-        .get(spreadsheetId=spreadsheet_id, range=range_str)
-        .execute()
-    )
-    return spreadsheet
-
-def update_spreadsheet(creds, spreadsheet_id, data_map):
-    """ Modifies a SpreadSheet range. """
-    service = build("sheets", "v4", credentials=creds)
+    service = get_sheets_service(creds)
+    request = service.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=range_str)
+    return get_scheduler(creds).execute(request)
+
+def chunk_ranges(ranges, max_ranges=MAX_BATCH_RANGES, max_chars=MAX_BATCH_URL_CHARS):
+    """ Splits a list of ranges into batches fitting the batchGet request limits. """
+    chunk, chunk_chars = [], 0
+    for range_str in ranges:
+        range_chars = len(urllib.parse.quote(range_str)) + len("&ranges=")
+        if chunk and (len(chunk) >= max_ranges or chunk_chars + range_chars > max_chars):
+            yield chunk
+            chunk, chunk_chars = [], 0
+        chunk.append(range_str)
+        chunk_chars += range_chars
+    if chunk:
+        yield chunk
+
+def get_spreadsheet_ranges(creds, spreadsheet_id, ranges):
+    """
+    Fetches multiple ranges using batchGet (as few requests as possible).
+    Returns the list of ValueRange objects (in the same order as the requested ranges).
+    """
+    service = get_sheets_service(creds)
+    requests = [service.spreadsheets().values().batchGet(spreadsheetId=spreadsheet_id, ranges=chunk)
+                for chunk in chunk_ranges(ranges)]
+    value_ranges = []
+    for result in get_scheduler(creds).execute_all(requests):
+        value_ranges.extend(result.get("valueRanges", []))
+    return value_ranges
+
+def update_spreadsheet(creds, spreadsheet_id, data_map, max_ranges=MAX_UPDATE_RANGES, retry=True):
+    """
+    Modifies SpreadSheet ranges (using as few batchUpdate requests as the
+    size limit allows). Returns the list of responses.
+    With retry=False, transient errors are not retried (see RequestScheduler).
+    """
+    service = get_sheets_service(creds)
     data = [{"range": key, "values": val} for key, val in data_map.items()]
-    body = {"valueInputOption": "USER_ENTERED", "data": data}
-    spreadsheet = (
-        service.spreadsheets()
-        .values()
-        .batchUpdate(spreadsheetId=spreadsheet_id, body=body)
-        .execute()
-    )
-    return spreadsheet
+    requests = []
+    for start in range(0, len(data), max_ranges):
+        body = {"valueInputOption": "USER_ENTERED", "data": data[start:start + max_ranges]}
+        requests.append(service.spreadsheets().values()
+                        .batchUpdate(spreadsheetId=spreadsheet_id, body=body))
+    return get_scheduler(creds).execute_all(requests, retry=retry)
+
+class ColumnMatcher:
+    """
+    Matches header values against all configured columnPatterns at once, using
+    a single precompiled alternation regex (the first listed pattern wins).
+    """
+
+    def __init__(self, patterns):
+        self.entries = []
+        alternatives = []
+        combinable = True
+        for pat_name, pat_re in patterns.items():
+            re_patterns = pat_re if isinstance(pat_re, list) else [pat_re]
+            for rpat in re_patterns:
+                alternatives.append("(?P<_p%d>%s)" % (len(self.entries), rpat))
+                self.entries.append((pat_name, re.compile(rpat, re.I | re.S)))
+                # group references would point to the wrong groups once combined
+                if re.search(r"\\[1-9]|\(\?P=|\(\?\(", rpat):
+                    combinable = False
+        self.combined = None
+        if combinable and self.entries:
+            try:
+                self.combined = re.compile("|".join(alternatives), re.I | re.S)
+            except re.error:
+                pass  # e.g., duplicate group names; match them one by one
+
+    def match(self, val):
+        """ Returns the (pattern name, match object) of the first matching pattern. """
+        if self.combined:
+            col_matches = self.combined.match(val)
+            if not col_matches:
+                return None
+            pat_name, pat_re = self.entries[int(col_matches.lastgroup[2:])]
+            return (pat_name, pat_re.match(val))
+        for pat_name, pat_re in self.entries:
+            col_matches = pat_re.match(val)
+            if col_matches:
+                return (pat_name, col_matches)
+        return None
+
+_column_matchers = {}
+
+def get_column_matcher(patterns):
+    """ Returns the (compiled once per process) matcher for the given patterns. """
+    key = json.dumps(patterns, sort_keys=True)
+    if key not in _column_matchers:
+        _column_matchers[key] = ColumnMatcher(patterns)
+    return _column_matchers[key]
+
+def map_columns(header, patterns, cache=None):
+    """
+    Maps the header row's columns to property names using the configured regex.
+    The result is memoized inside the cache (keyed by the header + patterns hash).
+    """
+    with profile.phase("columns"):
+        return _map_columns(header, patterns, cache)
+
+def _map_columns(header, patterns, cache=None):
+    memo_key = None
+    if cache:
+        memo_key = hashlib.sha1(json.dumps([header, patterns], sort_keys=True)
+                                .encode()).hexdigest()
+        columnMap = cache.get_column_map(memo_key)
+        if columnMap is not None:
+            return columnMap
+    matcher = get_column_matcher(patterns)
+    columnMap = {}
+    for idx, val in enumerate(header):
+        val = val.strip()
+        if not val:
+            continue
+        result = matcher.match(val)
+        if not result:
+            continue
+        pat_name, col_matches = result
+        if pat_name == "_":
+            if len(col_matches.groups()) > 0: name = col_matches.group(1)
+            else: name = val
+        elif pat_name[0] == "_":
+            name = col_matches.expand(pat_name[1:])
+        else:
+            name = pat_name
+        if not name:
+            continue
+        columnMap[name] = idx
+    for pat_name, pat_re in patterns.items():
+        if pat_name[0] != "_" and pat_name not in columnMap:
+            raise IndexError(f"Column not found: {{{pat_name}: {pat_re}}}")
+    if cache:
+        cache.set_column_map(memo_key, columnMap)
+    return columnMap
+
+def build_row_range(sheet_info, row_num):
+    """ Returns the A1 notation of a single row inside a sheet's fetch range. """
+    obj = sheet_info["obj"]
+    return build_a1notation([obj[0], (obj[1][0], row_num), (obj[2][0], row_num)])
 
+def get_cache(sheetsCfg):
+    """ Opens the configured data cache. """
+    with profile.phase("cache"):
+        return open_cache(sheetsCfg.get("cache", ".cache.db"))
 
-def fetch_data(sheetsCfg, creds, force=False, cached=False, filter_range=None):
+def download_data(sheetsCfg, creds, cache=None):
+    """ Downloads all configured ranges and maps their columns. """
     ranges = sheetsCfg.get("sheetRanges")
-    cacheFile = sheetsCfg.get("cache", ".cache.json")
-    data = None
-    if cached: force = False
-    if os.path.exists(cacheFile) and not force:
-        with open(cacheFile, "r") as f:
-            data = json.load(f)
-    elif cached:
-        raise FileNotFoundError("Cached data not found:" + cacheFile)
-    if not data:
-        data = {"values": [], "meta": {}}
-        patterns = sheetsCfg.get("columnPatterns")
-        for range_str in ranges:
-            # record metadata for current range object
-            sheet_info = {"obj": parse_sheet_range(range_str), "columnMap": None}
-            spreadsheet = get_spreadsheet(creds, sheetsCfg.get("id"), range_str)
-            rows = spreadsheet.get("values", [])
-            row_num = sheet_info["obj"][1][1]
-            for row in rows:
-                # map columns based on configured regex
-                if not sheet_info["columnMap"]:  ## first row is the header
-                    columnMap = {}
-                    for idx, val in enumerate(row):
-                        val = val.strip()
-                        if not val:
-                            continue
-                        name = None
-                        for pat_name, pat_re in patterns.items():
-                            re_patterns = pat_re if isinstance(pat_re, list) else [pat_re]
-                            for rpat in re_patterns:
-                                col_matches = re.match(rpat, val, re.I | re.S)
-                                if not col_matches: continue
-                                if pat_name == "_":
-                                    if len(col_matches.groups()) > 0: name = col_matches.group(1)
-                                    else: name = val
-                                elif pat_name[0] == "_":
-                                    name = col_matches.expand(pat_name[1:])
-                                else:
-                                    name = pat_name
-                                break
-                            if name: break
-                        if not name:
-                            continue
-                        columnMap[name] = idx
-                    for pat_name, pat_re in patterns.items():
-                        if pat_name[0] != "_" and pat_name not in columnMap:
-                            raise IndexError(f"Column not found: {{{pat_name}: {pat_re}}}")
-                    sheet_info["columnMap"] = columnMap
-                else:
-                    if row and row[0]:
-                        obj = {"row": row, "row_num": row_num, "parent_sheet": sheet_info["obj"][0]}
-                        data["values"].append(obj)
-                row_num += 1
-            data["meta"][sheet_info["obj"][0]] = sheet_info
-        # cache the data into a JSON for further retrieval
-        with open(cacheFile, "w") as f:
-            json.dump(data, f)
-    if filter_range:
-        filter_range_obj = parse_sheet_range(filter_range)
-        filter_sheet = filter_range_obj[0]
-        filter_row_idx = filter_range_obj[1][1]
-        for obj in data["values"]:
-            if (obj["parent_sheet"] == filter_sheet) and (obj["row_num"] == filter_row_idx):
-                sheet_info = data["meta"][obj["parent_sheet"]]
-                return (obj, sheet_info)
+    data = {"values": [], "meta": {}}
+    patterns = sheetsCfg.get("columnPatterns")
+    value_ranges = get_spreadsheet_ranges(creds, sheetsCfg.get("id"), ranges)
+    for range_str, spreadsheet in zip(ranges, value_ranges):
+        # record metadata for current range object
+        sheet_info = {"obj": parse_sheet_range(range_str), "columnMap": None}
+        rows = spreadsheet.get("values", [])
+        row_num = sheet_info["obj"][1][1]
+        for row in rows:
+            # map columns based on configured regex
+            if not sheet_info["columnMap"]:  ## first row is the header
+                sheet_info["columnMap"] = map_columns(row, patterns, cache)
+                sheet_info["header"] = row
+            else:
+                if row and row[0]:
+                    data["values"].append(CachedRow(row, row_num, sheet_info["obj"][0]))
+            row_num += 1
+        data["meta"][sheet_info["obj"][0]] = sheet_info
     return data
 
-def do_fetch_data(sheetsCfg, creds, cached=False, filter_range=None):
-    data = fetch_data(sheetsCfg, creds, force=(not cached),
-                      cached=cached, filter_range=filter_range)
+def config_hash(sheetsCfg):
+    """ Hash of the config options affecting the downloaded data. """
+    return json.dumps([sheetsCfg.get("sheetRanges"), sheetsCfg.get("columnPatterns")],
+                      sort_keys=True)
+
+def get_change_check_token(sheetsCfg, creds):
+    """
+    Cheap remote change check: returns a hash of the header rows and the
+    configured `changeCheckRange` (e.g., a checksum formula / last edit time
+    cell), fetched using a single request (or None if not configured).
+    """
+    check_ranges = sheetsCfg.get("changeCheckRange")
+    if not check_ranges:
+        return None
+    if isinstance(check_ranges, str):
+        check_ranges = [check_ranges]
+    ranges = list(check_ranges)
+    for range_str in sheetsCfg.get("sheetRanges"):
+        obj = parse_sheet_range(range_str)
+        ranges.append(build_a1notation([obj[0], (obj[1][0], obj[1][1]), (obj[2][0], obj[1][1])]))
+    value_ranges = get_spreadsheet_ranges(creds, sheetsCfg.get("id"), ranges)
+    return hashlib.sha1(json.dumps([config_hash(sheetsCfg)] +
+                                   [vr.get("values", []) for vr in value_ranges])
+                        .encode()).hexdigest()
+
+def get_content_hash(sheetsCfg, data):
+    """ Returns the hash of the downloaded gradebook data. """
+    h = hashlib.sha1(config_hash(sheetsCfg).encode())
+    for obj in data["values"]:
+        h.update(json.dumps([obj["parent_sheet"], obj["row_num"], obj["row"]]).encode())
+    h.update(json.dumps(data["meta"], sort_keys=True).encode())
+    return h.hexdigest()
+
+def refresh_rows(sheetsCfg, creds, cache, a1_rows):
+    """
+    Incrementally refreshes the given rows: only downloads them (and their
+    sheets' header rows) and patches the cache in place.
+    Falls back to a full refresh if any header (i.e., the columnMap) changed.
+    """
+    # the patched cache no longer matches the last full download's content hash
+    cache.set_change_tokens()
+    meta = cache.get_meta()
+    targets = []
+    for a1 in a1_rows:
+        range_obj = parse_sheet_range(a1)
+        sheet_info = meta.get(range_obj[0])
+        if not sheet_info or "header" not in sheet_info:
+            targets = None  # unknown sheet / old cache format
+            break
+        obj = sheet_info["obj"]
+        row_num = range_obj[1][1]
+        if row_num is None or row_num <= obj[1][1] or (obj[2][1] and row_num > obj[2][1]):
+            raise ValueError("Row outside of the fetched range: '%s'" % (a1,))
+        targets.append((range_obj[0], row_num))
+    if targets is None:
+        cache.replace(download_data(sheetsCfg, creds, cache))
+        return
+    sheets = list(dict.fromkeys(sheet for sheet, _ in targets))
+    ranges = [build_row_range(meta[sheet], meta[sheet]["obj"][1][1]) for sheet in sheets]
+    ranges += [build_row_range(meta[sheet], row_num) for sheet, row_num in targets]
+    value_ranges = get_spreadsheet_ranges(creds, sheetsCfg.get("id"), ranges)
+    for sheet, value_range in zip(sheets, value_ranges):
+        header = (value_range.get("values") or [[]])[0]
+        if header != meta[sheet]["header"]:
+            cache.replace(download_data(sheetsCfg, creds, cache))
+            return
+    cache.update_rows(
+        (sheet, row_num, (value_range.get("values") or [[]])[0], meta[sheet]["columnMap"])
+        for (sheet, row_num), value_range in zip(targets, value_ranges[len(sheets):]))
+
+def sync_cache(sheetsCfg, creds, force=False, cached=False, refresh_rows_a1=None,
+               full=False):
+    """
+    Makes sure the cache contains the gradebook data (downloads it if forced /
+    not available) and returns the cache object.
+    If refresh_rows_a1 is given, only those rows are re-downloaded into the
+    (already existing) cache.
+    Forced downloads are skipped when the spreadsheet did not change since the
+    last one (see get_change_check_token), unless `full` is given.
+    """
+    cacheFile = sheetsCfg.get("cache", ".cache.db")
+    cache = get_cache(sheetsCfg)
+    if cached: force = False
+    if refresh_rows_a1 and not cached and cache.has_data():
+        refresh_rows(sheetsCfg, creds, cache, refresh_rows_a1)
+        reapply_pending(cache)
+    elif force or not cache.has_data():
+        if cached:
+            raise FileNotFoundError("Cached data not found:" + cacheFile)
+        tokens = cache.get_change_tokens() if (cache.has_data() and not full) else {}
+        check_token = get_change_check_token(sheetsCfg, creds)
+        if check_token and check_token == tokens.get("check"):
+            return cache  # unchanged: skip the download
+        # cache the data into the database for further retrieval
+        data = download_data(sheetsCfg, creds, cache)
+        content_hash = get_content_hash(sheetsCfg, data)
+        if content_hash != tokens.get("content"):
+            with profile.phase("cache"):
+                cache.replace(data)
+            reapply_pending(cache)
+        cache.set_change_tokens(check=check_token, content=content_hash)
+    else:
+        return cache
+    refresh_listing(sheetsCfg, cache)
+    with profile.phase("cache"):
+        cache.refresh_search_index()
+    return cache
+
+def fetch_data(sheetsCfg, creds, force=False, cached=False, filter_range=None,
+               refresh_rows_a1=None, full=False):
+    """
+    Returns the gradebook data (from cache, unless forced / not available).
+    With filter_range, only returns the matching (row object, sheet_info) tuple
+    (or None if not found).
+    """
+    cache = sync_cache(sheetsCfg, creds, force=force, cached=cached,
+                       refresh_rows_a1=refresh_rows_a1, full=full)
+    with profile.phase("cache"):
+        if filter_range:
+            filter_range_obj = parse_sheet_range(filter_range)
+            obj = cache.get_row(filter_range_obj[0], filter_range_obj[1][1])
+            if not obj:
+                return None
+            return (obj, cache.get_meta()[obj["parent_sheet"]])
+        return cache.load()
+
+class RowFormatFields:
+    """ The str.format_map() fields of a row (only the used ones are computed). """
+
+    __slots__ = ("dataObj", "sheet_info", "rowObj")
+
+    def __init__(self, dataObj, sheet_info):
+        self.dataObj = dataObj
+        self.sheet_info = sheet_info
+        self.rowObj = RemappedRow(dataObj["row"], sheet_info["columnMap"])
+
+    def __getitem__(self, key):
+        if key == "row_num":
+            return self.dataObj["row_num"]
+        if key == "a1_str":
+            return build_a1notation([self.sheet_info["obj"][0],
+                                     (self.sheet_info["obj"][1][0], self.dataObj["row_num"])])
+        if key == "obj_str":
+            return str(dict(self.rowObj))
+        return self.rowObj[key]
+
+def format_row(fmt, dataObj, sheet_info):
+    """ Formats a row object using a listFormat / infoFormat string. """
+    return fmt.format_map(RowFormatFields(dataObj, sheet_info))
+
+def get_listing_file(sheetsCfg):
+    """ Returns the path of the pre-rendered listing file (next to the cache). """
+    if sheetsCfg.get("listingFile"):
+        return sheetsCfg["listingFile"]
+    return os.path.splitext(get_cache(sheetsCfg).path)[0] + ".list"
+
+def refresh_listing(sheetsCfg, cache):
+    """
+    Keeps the pre-rendered listing file in sync with the cache: only the
+    modified rows are (re)formatted, then the file is rewritten.
+    """
+    with profile.phase("output"):
+        return _refresh_listing(sheetsCfg, cache)
+
+def _refresh_listing(sheetsCfg, cache):
+    displayFormat = sheetsCfg.get("listFormat", "{a1_str} | {obj_str}")
+    if cache.get_prop("listing_format") != displayFormat:
+        cache.clear_listing(displayFormat)
+    listingFile = get_listing_file(sheetsCfg)
+    meta = None
+    rendered = []
+    for dataObj in cache.get_unrendered_rows():
+        meta = meta or cache.get_meta()
+        rendered.append((format_row(displayFormat, dataObj, meta[dataObj["parent_sheet"]]),
+                         dataObj["parent_sheet"], dataObj["row_num"]))
+    if rendered:
+        cache.set_listing(rendered)
+    elif os.path.exists(listingFile) and not cache.is_listing_outdated():
+        return listingFile
+    # (also rewritten when rows were only removed / sheets reordered)
+    tmpFile = listingFile + ".tmp"
+    with open(tmpFile, "w") as f:
+        f.writelines(line + "\n" for line in cache.get_listing())
+    os.replace(tmpFile, listingFile)
+    cache.set_listing_written()
+    return listingFile
+
+def do_fetch_data(sheetsCfg, creds, cached=False, filter_range=None,
+                  incremental=False, rows=None, full=False):
+    refresh_rows_a1 = None
+    if incremental:
+        refresh_rows_a1 = ([filter_range] if filter_range else []) + (rows or [])
+        if not refresh_rows_a1:
+            raise ValueError("Incremental refresh requires --filter-range and/or --row!")
     if filter_range:
+        data = fetch_data(sheetsCfg, creds, force=(not cached and not incremental),
+                          cached=cached, filter_range=filter_range,
+                          refresh_rows_a1=refresh_rows_a1, full=full)
         infoFormat = sheetsCfg.get("infoFormat", "{a1_str}: {username}: {obj_str}")
         if not data:
             print("Object not found!")
             return
-        dataObj = data[0]
-        sheet_info = data[1]
-        rowObj = remap_row(dataObj["row"], sheet_info["columnMap"])
-        obj_str = str(rowObj)
-        a1_str = build_a1notation([sheet_info["obj"][0],
-                                  (sheet_info["obj"][1][0], dataObj["row_num"])])
-        print(infoFormat.format(
-            row_num=dataObj["row_num"], a1_str=a1_str, obj_str=obj_str, **rowObj))
+        with profile.phase("output"):
+            print(format_row(infoFormat, data[0], data[1]))
         return
 
-    displayFormat = sheetsCfg.get("listFormat", "{a1_str} | {obj_str}")
-    for dataObj in data["values"]:
-        sheet_info = data["meta"][dataObj["parent_sheet"]]
-        rowObj = remap_row(dataObj["row"], sheet_info["columnMap"])
-        obj_str = str(rowObj)
-        a1_str = build_a1notation([sheet_info["obj"][0],
-                                  (sheet_info["obj"][1][0], dataObj["row_num"])])
-        print(displayFormat.format(
-            row_num=dataObj["row_num"], a1_str=a1_str, obj_str=obj_str, **rowObj))
+    cache = sync_cache(sheetsCfg, creds, force=(not cached and not incremental),
+                       cached=cached, refresh_rows_a1=refresh_rows_a1, full=full)
+    listingFile = refresh_listing(sheetsCfg, cache)
+    with profile.phase("output"), open(listingFile, "r") as f:
+        sys.stdout.write(f.read())
+
+def do_print_listing_file(sheetsCfg):
+    print(refresh_listing(sheetsCfg, sync_cache(sheetsCfg, None, cached=True)))
+
+def do_search(args, sheetsCfg):
+    """
+    Searches the cached rows by username / full name (see
+    GradebookCache.search) and prints the matches (best first) using the
+    listFormat. Without a query (or with '-'), reads one query per line from
+    stdin and prefixes each result with its query (tab-separated).
+    """
+    cache = sync_cache(sheetsCfg, None, cached=True)
+    with profile.phase("cache"):
+        cache.refresh_search_index()
+        meta = cache.get_meta()
+    displayFormat = args.format or sheetsCfg.get("listFormat", "{a1_str} | {obj_str}")
+    query = " ".join(args.query)
+    batch = query in ("", "-")
+    queries = (line.strip() for line in sys.stdin) if batch else [query]
+    for query in queries:
+        if not query:
+            continue
+        with profile.phase("cache"):
+            results = cache.search(query, limit=args.limit, min_score=args.min_score)
+        with profile.phase("output"):
+            for score, dataObj in results:
+                line = format_row(displayFormat, dataObj, meta[dataObj["parent_sheet"]])
+                if args.scores:
+                    line = "%.2f\t%s" % (score, line)
+                print(query + "\t" + line if batch else line)
+            if not results and not batch:
+                print("No matches found!", file=sys.stderr)
+
+def get_cached_metadata(sheetsCfg):
+    """ Returns the cached spreadsheet metadata (without loading the rows). """
+    cacheFile = sheetsCfg.get("cache", ".cache.db")
+    cache = open_cache(cacheFile)
+    if not cache.has_data():
+        raise FileNotFoundError("Cached data not found:" + cacheFile)
+    return cache.get_meta()
 
 def do_print_metadata(sheetsCfg, creds):
-    data = fetch_data(sheetsCfg, creds, cached=True)
-    print(data["meta"])
+    print(get_cached_metadata(sheetsCfg))
 
 def do_update_cell(args, sheetsCfg, creds):
-    data = fetch_data(sheetsCfg, creds, cached=True)
+    meta = get_cached_metadata(sheetsCfg)
     range_obj = parse_sheet_range(args.a1)
     data_map = {}
     for val_str in args.value:
@@ -229,50 +642,611 @@ def do_update_cell(args, sheetsCfg, creds):
         val_split = val_str.split("=", 1)
         if len(val_split) == 2:
             col_idx = column_letter_to_idx(range_obj[1][0])
-            col_idx += data["meta"][range_obj[0]]["columnMap"][val_split[0]]
+            col_idx += meta[range_obj[0]]["columnMap"][val_split[0]]
             new_range_obj[1] = (column_idx_to_letter(col_idx), range_obj[1][1])
             val_str = val_split[1]
         new_range_str = build_a1notation(new_range_obj)
         data_map[new_range_str] = [[val_str]]
     print("set", data_map)
-    if not args.dry_run:
+    if args.dry_run:
+        return
+    write_cells(sheetsCfg, creds, meta, data_map, queue=(not args.no_queue))
+
+def write_cells(sheetsCfg, creds, meta, data_map, queue=True, flush=False):
+    """
+    Writes the given cells (either directly or through the write-behind queue,
+    if enabled) and reflects the new values inside the cache.
+    """
+    cache = get_cache(sheetsCfg)
+    queueCfg = sheetsCfg.get("writeQueue", {})
+    if queueCfg.get("enabled") and queue:
+        cache.queue_writes(data_map)
+        apply_cell_updates(cache, meta, data_map)
+        flush_pending(sheetsCfg, creds, cache, force=flush)
+    else:
         update_spreadsheet(creds, sheetsCfg.get("id"), data_map=data_map)
+        # older queued values of these cells must not overwrite the new ones later
+        cache.remove_pending([entry for entry in cache.get_pending() if entry["a1"] in data_map])
+        # the next download must not be skipped (see sync_cache)
+        cache.set_change_tokens()
+        apply_cell_updates(cache, meta, data_map)
+    refresh_listing(sheetsCfg, cache)
 
-if __name__ == "__main__":
+def apply_cell_updates(cache, meta, data_map):
+    """ Reflects the written cell values inside the cached rows. """
+    rows = {}
+    for range_str, values in data_map.items():
+        range_obj = parse_sheet_range(range_str)
+        sheet_info = meta.get(range_obj[0])
+        col, row_num = range_obj[1]
+        if not sheet_info or not col or not row_num:
+            continue
+        col_offset = column_letter_to_idx(col) - column_letter_to_idx(sheet_info["obj"][1][0])
+        key = (range_obj[0], row_num)
+        if key not in rows:
+            rows[key] = cache.get_row(range_obj[0], row_num)
+        obj = rows[key]
+        if not obj or col_offset < 0:
+            continue  # new row / outside of fetched range (will appear on refresh)
+        row = obj["row"]
+        row.extend([""] * (col_offset + 1 - len(row)))
+        row[col_offset] = values[0][0]
+    cache.update_rows((sheet, row_num, obj["row"], meta[sheet]["columnMap"])
+                      for (sheet, row_num), obj in rows.items() if obj)
+
+def reapply_pending(cache):
+    """ Re-applies the queued (unsent) writes over freshly downloaded rows. """
+    pending = cache.get_pending()
+    if pending:
+        apply_cell_updates(cache, cache.get_meta(),
+                           {entry["a1"]: entry["values"] for entry in pending})
+
+def is_flush_due(sheetsCfg, pending):
+    """ Returns whether the queued writes reached the configured size / age thresholds. """
+    queueCfg = sheetsCfg.get("writeQueue", {})
+    if not pending:
+        return False
+    oldest = min(entry["queued_at"] for entry in pending)
+    return (len(pending) >= queueCfg.get("maxPending", 20) or
+            time.time() - oldest >= queueCfg.get("maxAge", 60))
+
+def flush_pending(sheetsCfg, creds, cache, force=True, retry=None):
+    """
+    Sends the queued (write-behind) cell updates as a single batchUpdate request.
+    Unless forced, only flushes when the configured size / age thresholds are
+    reached and network errors are only reported (the writes remain queued).
+    Transient errors are only retried for forced flushes (unless `retry` is given).
+    """
+    pending = cache.get_pending()
+    if not pending:
+        return 0
+    if not force and not is_flush_due(sheetsCfg, pending):
+        return 0
+    data_map = {entry["a1"]: entry["values"] for entry in pending}
+    try:
+        update_spreadsheet(creds, sheetsCfg.get("id"), data_map=data_map,
+                           retry=force if retry is None else retry)
+    except Exception as e:
+        if force:
+            raise
+        print("WARNING: flush failed (%d writes still pending): %s" % (len(pending), e),
+              file=sys.stderr)
+        return 0
+    cache.remove_pending(pending)
+    cache.set_change_tokens()
+    print("flushed %d pending writes" % (len(pending),))
+    return len(pending)
+
+def do_flush(sheetsCfg, creds):
+    cache = get_cache(sheetsCfg)
+    if not flush_pending(sheetsCfg, creds, cache):
+        print("No pending writes!")
+
+def do_print_pending(sheetsCfg):
+    cache = get_cache(sheetsCfg)
+    pending = cache.get_pending()
+    now = time.time()
+    for entry in pending:
+        print("%s = %s (queued %ds ago)" % (entry["a1"], entry["values"][0][0],
+                                           now - entry["queued_at"]))
+    print("%d pending writes" % (len(pending),))
+
+
+def read_import_records(filename, fmt=None):
+    """ Reads the records (dicts) to import from a CSV / TSV / JSONL file ('-' for stdin). """
+    if not fmt:
+        fmt = os.path.splitext(filename)[1][1:].lower() if filename != "-" else "csv"
+    # (spreadsheet apps export UTF-8 CSVs with a BOM, which would end up in the first header)
+    if filename == "-":
+        f = io.StringIO(sys.stdin.read().lstrip("\ufeff"), newline="")
+    else:
+        f = open(filename, "r", newline="", encoding="utf-8-sig")
+    with f:
+        if fmt == "jsonl":
+            return [json.loads(line) for line in f if line.strip()]
+        if fmt not in ("csv", "tsv"):
+            raise ValueError("Unsupported import format: '%s'" % (fmt,))
+        return list(csv.DictReader(f, delimiter=("\t" if fmt == "tsv" else ",")))
+
+def build_row_index(data, key):
+    """ Builds an in-memory hash index (key value -> row objects) for a mapped column. """
+    index = {}
+    for obj in data["values"]:
+        columnMap = data["meta"][obj["parent_sheet"]]["columnMap"]
+        idx = columnMap.get(key)
+        if idx is not None and idx < len(obj["row"]) and obj["row"][idx].strip():
+            index.setdefault(obj["row"][idx].strip(), []).append(obj)
+    return index
+
+def build_key_index(cache, key):
+    """ Returns a (key value -> row objects) lookup function for a mapped column. """
+    if key in INDEXED_COLUMNS:
+        return lambda value: cache.find_rows(key, value)
+    # not indexed inside the cache: build an in-memory hash index
+    index = build_row_index(cache.load(), key)
+    return lambda value: index.get(value, [])
+
+def do_import(args, sheetsCfg, creds):
+    cache = sync_cache(sheetsCfg, creds, cached=True)
+    meta = cache.get_meta()
+    lookup = build_key_index(cache, args.key)
+    records = read_import_records(args.file, args.format)
+    data_map = {}
+    unmatched, ambiguous, unknown_columns = [], [], set()
+    no_key = 0
+    for record in records:
+        key_value = str(record.get(args.key) or "").strip()
+        if not key_value:
+            no_key += 1
+            continue
+        objs = lookup(key_value)
+        if not objs:
+            unmatched.append(key_value)
+            continue
+        if len(objs) > 1:
+            ambiguous.append(key_value)
+            continue
+        obj = objs[0]
+        sheet_info = meta[obj["parent_sheet"]]
+        start_col = column_letter_to_idx(sheet_info["obj"][1][0])
+        for column, value in record.items():
+            if column == args.key:
+                continue
+            value = "" if value is None else str(value)
+            if not value and not args.keep_empty:
+                continue
+            if column not in sheet_info["columnMap"]:
+                unknown_columns.add(column)
+                continue
+            col_letter = column_idx_to_letter(start_col + sheet_info["columnMap"][column])
+            data_map[build_a1notation([obj["parent_sheet"], (col_letter, obj["row_num"])])] = [[value]]
+
+    print("import: %d records, %d cells to update" % (len(records), len(data_map)))
+    if no_key:
+        print("import: SKIPPED %d records without a '%s' value" % (no_key, args.key))
+    if unknown_columns:
+        print("import: ignored unknown columns: %s" % (", ".join(sorted(unknown_columns)),))
+    if ambiguous:
+        print("import: SKIPPED ambiguous keys (multiple rows): %s" % (", ".join(ambiguous),))
+    if unmatched:
+        print("import: UNMATCHED keys: %s" % (", ".join(unmatched),))
+    if args.dry_run:
+        for range_str, values in data_map.items():
+            print("set %s = %s" % (range_str, values[0][0]))
+        return
+    if data_map:
+        write_cells(sheetsCfg, creds, meta, data_map, flush=True)
+
+
+def read_moodle_worksheet(filename):
+    """
+    Reads a Moodle grading worksheet (CSV) and returns its records: dicts with
+    the worksheet's columns plus the 'id', 'email' and 'username' join keys.
+    """
+    records = []
+    with open(filename, "r", newline="") as f:
+        for record in csv.DictReader(f):
+            # note: the ID column contains a text prefix, so extract just the number
+            record["id"] = re.sub(r"[^0-9]", "", record.get("Identifier") or "")
+            record["email"] = (record.get("Email address") or "").strip()
+            record["username"] = record["email"].split("@")[0]
+            records.append(record)
+    return records
+
+def parse_moodle_date(date_str):
+    """ Parses a Moodle worksheet date (returns None for no date). """
+    date_str = (date_str or "").strip()
+    if not date_str or date_str == "-":
+        return None
+    for fmt in MOODLE_DATE_FORMATS:
+        try:
+            return datetime.strptime(date_str, fmt)
+        except ValueError:
+            pass
+    raise ValueError("Unknown date format: '%s'" % (date_str,))
+
+def late_days(submitted, deadline):
+    """ Returns the number of (started) days a submission is late, as string. """
+    if submitted is None:
+        return ""
+    if submitted <= deadline:
+        return "0"
+    return str(math.ceil((submitted - deadline).total_seconds() / 86400))
+
+def moodle_sync_values(record, columns, late_column=None, deadline=None):
+    """ Computes the gradebook values (by mapped column) for a worksheet record. """
+    values = {}
+    for name, moodle_col in columns.items():
+        value = (record.get(moodle_col) or "").strip()
+        if moodle_col in MOODLE_DATE_COLUMNS:
+            date = parse_moodle_date(value)
+            value = date.strftime("%Y-%m-%d %H:%M") if date else ""
+        values[name] = value
+    if late_column:
+        values[late_column] = late_days(
+            parse_moodle_date(record.get(MOODLE_SUBMISSION_DATE_COLUMN)), deadline)
+    return values
+
+def do_sync_moodle(args, sheetsCfg, creds):
+    syncCfg = sheetsCfg.get("moodleSync", {})
+    key = args.key or syncCfg.get("key", "username")
+    moodle_key = args.moodle_key or syncCfg.get("moodleKey", "username")
+    columns = dict(syncCfg.get("columns") or {})
+    for spec in args.column or []:
+        name, sep, moodle_col = spec.partition("=")
+        if not sep:
+            raise ValueError("Invalid --column (expected 'column=Worksheet Column'): '%s'" % (spec,))
+        columns[name] = moodle_col
+    late_column = args.late_days_column or syncCfg.get("lateDaysColumn")
+    deadline = parse_moodle_date(args.deadline or syncCfg.get("deadline"))
+    if late_column and not deadline:
+        raise ValueError("A deadline is required for computing the late days!")
+    if not columns and not late_column:
+        raise ValueError("Nothing to sync (no columns / late days column configured)!")
+
+    cache = sync_cache(sheetsCfg, creds, cached=True)
+    data = cache.load()
+    meta = data["meta"]
+    # hash join: index both sides by the key, then match the key sets
+    gsheet_index = build_row_index(data, key)
+    moodle_index = {}
+    for record in read_moodle_worksheet(args.worksheet):
+        if record.get(moodle_key):
+            moodle_index.setdefault(record[moodle_key], []).append(record)
+
+    data_map = {}
+    matched, ambiguous, unknown_columns = 0, [], set()
+    for key_value, records in moodle_index.items():
+        objs = gsheet_index.get(key_value)
+        if not objs:
+            continue
+        if len(objs) > 1 or len(records) > 1:
+            ambiguous.append(key_value)
+            continue
+        matched += 1
+        obj = objs[0]
+        sheet_info = meta[obj["parent_sheet"]]
+        start_col = column_letter_to_idx(sheet_info["obj"][1][0])
+        values = moodle_sync_values(records[0], columns, late_column, deadline)
+        for name, value in values.items():
+            idx = sheet_info["columnMap"].get(name)
+            if idx is None:
+                unknown_columns.add(name)
+                continue
+            current = obj["row"][idx] if idx < len(obj["row"]) else ""
+            if current == value or (not value and not args.keep_empty):
+                continue  # (by default, never clears the existing values)
+            col_letter = column_idx_to_letter(start_col + idx)
+            data_map[build_a1notation([obj["parent_sheet"], (col_letter, obj["row_num"])])] = [[value]]
+    moodle_only = sorted(moodle_index.keys() - gsheet_index.keys())
+    gsheet_only = sorted(gsheet_index.keys() - moodle_index.keys())
+
+    print("sync_moodle: %d rows matched, %d cells changed" % (matched, len(data_map)))
+    if unknown_columns:
+        print("sync_moodle: ignored unknown columns: %s" % (", ".join(sorted(unknown_columns)),))
+    if ambiguous:
+        print("sync_moodle: SKIPPED ambiguous keys (multiple rows): %s" % (", ".join(ambiguous),))
+    if moodle_only:
+        print("sync_moodle: only in the Moodle worksheet: %s" % (", ".join(moodle_only),))
+    if gsheet_only:
+        print("sync_moodle: only in the gradebook: %s" % (", ".join(gsheet_only),))
+    if args.dry_run:
+        for range_str, values in data_map.items():
+            print("set %s = %s" % (range_str, values[0][0]))
+        return
+    if data_map:
+        write_cells(sheetsCfg, creds, meta, data_map, flush=True)
+
+
+def reads_stdin(args):
+    """ Returns whether the parsed command reads its input from stdin. """
+    if args.command == "search":
+        return " ".join(args.query) in ("", "-")
+    return args.command == "import" and args.file == "-"
+
+
+class ToolRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Serves a single client request: one JSON line in, one JSON line out.
+    Commands reading stdin are answered with `{"need_stdin": true}` if the
+    request did not include it (the client then sends it again, with "stdin").
+    """
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        request = json.loads(line)
+        out, err = io.StringIO(), io.StringIO()
+        code = 0
+        response = None
+        orig_stdin = sys.stdin
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                args = self.server.parser.parse_args(request.get("argv", []))
+                if args.command == "serve":
+                    raise ValueError("Already serving!")
+                if reads_stdin(args) and "stdin" not in request:
+                    response = {"need_stdin": True}
+                else:
+                    sys.stdin = io.StringIO(request.get("stdin", ""))
+                    run_command(args, self.server.sheetsCfg, self.server.creds)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else 1
+            except Exception:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdin = orig_stdin
+        if response is None:
+            response = {"code": code, "stdout": out.getvalue(), "stderr": err.getvalue()}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class ToolServer(socketserver.UnixStreamServer):
+    """
+    Long-lived gsheet-tool server: keeps the credentials, the Sheets API service
+    and the parsed cache in memory between (thin client) requests.
+    """
+    timeout = 1.0
+
+    def __init__(self, socket_path, parser, sheetsCfg, creds, parent_pid=None, log_file=None):
+        self.parser = parser
+        self.sheetsCfg = sheetsCfg
+        self.creds = creds
+        self.parent_pid = parent_pid
+        self.log_file = log_file
+        self.stopped = False
+        # background flush state (see auto_flush)
+        self.next_flush = 0
+        self.flush_error = None
+        if os.path.exists(socket_path):
+            # remove stale socket (if no other server is listening)
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                try:
+                    s.connect(socket_path)
+                    raise OSError("Server already running on '%s'" % (socket_path,))
+                except (ConnectionRefusedError, FileNotFoundError):
+                    os.remove(socket_path)
+        super().__init__(socket_path, ToolRequestHandler)
+        os.chmod(socket_path, stat.S_IRUSR | stat.S_IWUSR)
+
+    def handle_timeout(self):
+        # quit when the parent (e.g., the gradebook TUI) is gone
+        if self.parent_pid:
+            try:
+                os.kill(self.parent_pid, 0)
+            except ProcessLookupError:
+                self.stopped = True
+        # periodically flush the write queue (if the max age is reached)
+        if time.time() >= self.next_flush:
+            self.auto_flush()
+
+    def log(self, message):
+        """ Logs a server message (to the log file, if given; the client's terminal is not ours). """
+        line = time.strftime("%Y-%m-%d %H:%M:%S ") + message + "\n"
+        if self.log_file:
+            with open(self.log_file, "a") as f:
+                f.write(line)
+        else:
+            sys.stderr.write(line)
+
+    def auto_flush(self):
+        """
+        Flushes the write queue when due, using a single attempt (not to block
+        the requests); on errors, waits for `maxAge` before trying again and
+        only logs the first failure of an outage.
+        """
+        cache = get_cache(self.sheetsCfg)
+        if not is_flush_due(self.sheetsCfg, cache.get_pending()):
+            return
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                flushed = flush_pending(self.sheetsCfg, self.creds, cache, retry=False)
+        except Exception as e:
+            self.next_flush = time.time() + self.sheetsCfg.get("writeQueue", {}).get("maxAge", 60)
+            if self.flush_error is None:
+                self.log("WARNING: flush failed (writes still pending, will retry): %s" % (e,))
+            self.flush_error = e
+            return
+        if self.flush_error is not None:
+            self.log("flush succeeded again")
+            self.flush_error = None
+        self.log("flushed %d pending writes" % (flushed,))
+
+    def serve_until_stopped(self):
+        try:
+            while not self.stopped:
+                self.handle_request()
+        finally:
+            self.server_close()
+            os.remove(self.server_address)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    flushed = flush_pending(self.sheetsCfg, self.creds, get_cache(self.sheetsCfg))
+                if flushed:
+                    self.log("flushed %d pending writes" % (flushed,))
+            except Exception as e:
+                self.log("WARNING: flush failed (writes still pending): %s" % (e,))
+                # the client is gone by now: make sure the user sees it
+                print("WARNING: flush failed (writes still pending): %s" % (e,), file=sys.stderr)
+
+
+def do_serve(args, parser, sheetsCfg, creds):
+    server = ToolServer(args.socket, parser, sheetsCfg, creds, parent_pid=args.parent_pid,
+                        log_file=args.log)
+    try:
+        server.serve_until_stopped()
+    except KeyboardInterrupt:
+        pass
+
+
+def build_arg_parser():
     parser = argparse.ArgumentParser("gsheet-tool.py",
                                      "")
     parser.add_argument("--config", "-c", help="Path to config file", default=CONFIG_FILE)
+    parser.add_argument("--api-stats", action="store_true",
+                        help="Print the Sheets API request metrics (to stderr) after the command")
+    parser.add_argument("--profile", action="store_const", const="-",
+                        default=os.environ.get("GSHEET_PROFILE"),
+                        help="Print per-phase timings / counters (as JSON lines) to stderr; " +
+                        "set the GSHEET_PROFILE env var to a file path to append them there")
+    parser.add_argument("--profile-dump", default=os.environ.get("GSHEET_PROFILE_DUMP"),
+                        help="Also save a cProfile dump of the command to this file " +
+                        "(or the GSHEET_PROFILE_DUMP env var)")
     subparsers = parser.add_subparsers(dest="command", required=True,
                                        title='commands', description='valid commands')
     subparsers.add_parser("auth", help="authenticates the Google API")
     p_fetch = subparsers.add_parser("fetch_data", help="fetches & caches all ranges from the spreadsheet")
     p_fetch.add_argument("--cached", action="store_true", help="always fetches data from cache")
     p_fetch.add_argument("--filter-range", required=False, help="only return a specific range")
+    p_fetch.add_argument("--incremental", action="store_true",
+                         help="only re-download the --filter-range / --row rows (patches the cache)")
+    p_fetch.add_argument("--row", action="append",
+                         help="A1 identifier of a (dirty) row to refresh with --incremental. " +
+                         "May be specified multiple times!")
+    p_fetch.add_argument("--full", action="store_true",
+                         help="always download everything (skip the unchanged spreadsheet check)")
     subparsers.add_parser("get_metadata", help="prints spreadsheet's detected metadata")
+    subparsers.add_parser("listing_file",
+                          help="prints the path of the (up to date) pre-rendered listing file")
+    p_search = subparsers.add_parser("search",
+                                     help="searches the cached rows by (accent-insensitive) name")
+    p_search.add_argument("query", nargs="*",
+                          help="Username / full name (fragment) to search; reads one query " +
+                          "per line from stdin if missing (or '-')")
+    p_search.add_argument("--limit", type=int, default=10, help="Max. results per query (default: 10)")
+    p_search.add_argument("--min-score", type=float, default=0.5,
+                          help="Min. fraction of the query's trigrams to match (default: 0.5)")
+    p_search.add_argument("--format", help="Result format (default: listFormat)")
+    p_search.add_argument("--scores", action="store_true", help="Prefix the results with their score")
     p_update = subparsers.add_parser("update", help="sets a specific cell value")
     p_update.add_argument("--a1", required=True,
                           help="A1 identifier of row/cell to change (including sheet name)")
     p_update.add_argument("--value", "--val", required=True, action="append",
                           help="'[column=]value' to update. May be specified multiple times!")
     p_update.add_argument("--dry-run", "-n", action="store_true", required=False, help="Do a dry run (dont update live sheet)")
+    p_update.add_argument("--no-queue", action="store_true",
+                          help="Send the update right away (bypass the write-behind queue)")
+    p_import = subparsers.add_parser("import", help="bulk imports values from a CSV / TSV / JSONL file")
+    p_import.add_argument("file", help="File to import ('-' for stdin); its columns must be mapped names")
+    p_import.add_argument("--format", choices=["csv", "tsv", "jsonl"],
+                          help="Input file format (default: guessed from the extension, or csv)")
+    p_import.add_argument("--key", default="username",
+                          help="Mapped column used to find the gradebook rows (default: username)")
+    p_import.add_argument("--keep-empty", action="store_true",
+                          help="Also import empty values (clears the cells)")
+    p_import.add_argument("--dry-run", "-n", action="store_true", help="Do a dry run (dont update live sheet)")
+    p_sync = subparsers.add_parser("sync_moodle",
+                                   help="syncs columns from a Moodle grading worksheet (see moodleSync)")
+    p_sync.add_argument("worksheet", help="The Moodle grading worksheet (CSV)")
+    p_sync.add_argument("--key", help="Mapped column to join on (default: username)")
+    p_sync.add_argument("--moodle-key", choices=["id", "email", "username"],
+                        help="Worksheet key to join on (default: username, i.e. the email's user)")
+    p_sync.add_argument("--column", action="append",
+                        help="'column=Worksheet Column' to sync. May be specified multiple times!")
+    p_sync.add_argument("--late-days-column", help="Mapped column to store the late days into")
+    p_sync.add_argument("--deadline", help="Submission deadline ('YYYY-MM-DD HH:MM')")
+    p_sync.add_argument("--keep-empty", action="store_true",
+                        help="Also sync empty values (clears the cells, e.g. for missing submissions)")
+    p_sync.add_argument("--dry-run", "-n", action="store_true", help="Do a dry run (dont update live sheet)")
+    subparsers.add_parser("flush", help="sends all queued (write-behind) updates")
+    subparsers.add_parser("pending", help="lists the queued updates not yet sent")
+    p_serve = subparsers.add_parser("serve", help="keeps running & serves gsheet-client.py requests")
+    p_serve.add_argument("--socket", default=SOCKET_FILE, help="Path of the Unix socket to listen on")
+    p_serve.add_argument("--parent-pid", type=int, required=False,
+                         help="Exit when the process with this PID terminates")
+    p_serve.add_argument("--log", help="Append the server's messages (e.g., background flush " +
+                         "errors) to this file (default: stderr)")
+    return parser
+
+def run_command(args, sheetsCfg, creds):
+    profiler = None
+    if args.profile or args.profile_dump:
+        import cProfile
+        profile.enable()
+        if args.profile_dump:
+            profiler = cProfile.Profile()
+            profiler.enable()
+    try:
+        with profile.phase("command"):
+            dispatch_command(args, sheetsCfg, creds)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile_dump)
+        if args.profile:
+            metrics = dict(_scheduler[1].metrics) if _scheduler else {}
+            profile.write_report(args.profile, command=args.command, extra={
+                "api_" + name: value for name, value in metrics.items()})
+        profile.disable()
+        profile.reset()
+        if args.api_stats:
+            print(_scheduler[1].format_metrics() if _scheduler else "API requests: 0",
+                  file=sys.stderr)
 
+def dispatch_command(args, sheetsCfg, creds):
+    if args.command == "auth":
+        creds.get()
+        print("Authentication successful (token saved)!")
+    elif args.command == "fetch_data":
+        do_fetch_data(sheetsCfg, creds, cached=args.cached,
+                      filter_range=args.filter_range,
+                      incremental=args.incremental, rows=args.row, full=args.full)
+    elif args.command == "get_metadata":
+        do_print_metadata(sheetsCfg, creds)
+    elif args.command == "listing_file":
+        do_print_listing_file(sheetsCfg)
+    elif args.command == "search":
+        do_search(args, sheetsCfg)
+    elif args.command == "update":
+        do_update_cell(args, sheetsCfg, creds)
+    elif args.command == "import":
+        do_import(args, sheetsCfg, creds)
+    elif args.command == "sync_moodle":
+        do_sync_moodle(args, sheetsCfg, creds)
+    elif args.command == "flush":
+        do_flush(sheetsCfg, creds)
+    elif args.command == "pending":
+        do_print_pending(sheetsCfg)
+
+if __name__ == "__main__":
+    parser = build_arg_parser()
     args = parser.parse_args()
+    if args.profile:
+        profile.enable(script_start=_script_start)
     if not args.command:
         parser.print_help()
     else:
         creds = None
         config = None
-        with open(os.path.expanduser(args.config), "r") as f:
+        with profile.phase("config"), open(os.path.expanduser(args.config), "r") as f:
             config = yaml.safe_load(f)
-        creds = auth_credentials(config.get("google_auth", {}))
+        # only authenticates when a command needs the network
+        creds = LazyCredentials(config.get("google_auth", {}))
         sheetsCfg = config.get("google_sheets", {})
-        if args.command == "auth":
-            print("Authentication successful (token saved)!")
-        elif args.command == "fetch_data":
-            do_fetch_data(sheetsCfg, creds, cached=args.cached,
-                          filter_range=args.filter_range)
-        elif args.command == "get_metadata":
-            do_print_metadata(sheetsCfg, creds)
-        elif args.command == "update":
-            do_update_cell(args, sheetsCfg, creds)
-
+        configure_api(sheetsCfg.get("api"))
+        if args.command == "serve":
+            do_serve(args, parser, sheetsCfg, creds)
+        else:
+            run_command(args, sheetsCfg, creds)
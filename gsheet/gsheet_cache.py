@@ -0,0 +1,466 @@
+# SQLite-based gradebook cache for gsheet-tool.py.
+# Stores the fetched rows indexed by (sheet, row_num) and by the mapped
+# username / fullname columns, so point lookups don't need to load the
+# whole gradebook.
+
+import array
+import json
+import math
+import os
+import os.path
+import re
+import sqlite3
+import time
+import unicodedata
+
+# current database schema version (see MIGRATIONS)
+SCHEMA_VERSION = 2
+# schema upgrade statements (by target version)
+MIGRATIONS = {
+    1: ["ALTER TABLE rows ADD COLUMN listing TEXT"],
+    2: ["ALTER TABLE rows ADD COLUMN search TEXT",
+        "UPDATE rows SET search = search_text(username, fullname)"],
+}
+
+# mapped columns to index (for fast lookups)
+INDEXED_COLUMNS = ("username", "fullname")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS props (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS meta (sheet TEXT PRIMARY KEY, pos INTEGER, info TEXT);
+CREATE TABLE IF NOT EXISTS rows (
+    sheet TEXT NOT NULL,
+    row_num INTEGER NOT NULL,
+    row TEXT NOT NULL,
+    username TEXT,
+    fullname TEXT,
+    listing TEXT,
+    search TEXT,
+    PRIMARY KEY (sheet, row_num)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rows_username ON rows (username);
+CREATE INDEX IF NOT EXISTS rows_search ON rows (search);
+CREATE INDEX IF NOT EXISTS rows_fullname ON rows (fullname);
+CREATE INDEX IF NOT EXISTS rows_unrendered ON rows (sheet) WHERE listing IS NULL;
+CREATE TABLE IF NOT EXISTS search_texts (
+    id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS search_grams (gram TEXT PRIMARY KEY, text_ids BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS column_maps (key TEXT PRIMARY KEY, column_map TEXT);
+CREATE TABLE IF NOT EXISTS pending (
+    a1 TEXT PRIMARY KEY,
+    vals TEXT NOT NULL,
+    queued_at REAL NOT NULL,
+    seq INTEGER NOT NULL
+);
+"""
+
+
+def cache_db_path(cache_file):
+    """ Returns the SQLite database path for the configured cache file. """
+    base, ext = os.path.splitext(cache_file)
+    if ext == ".json":  # legacy config value
+        return base + ".db"
+    return cache_file
+
+
+class CachedRow:
+    """
+    Compact row object (no per-row dict; the sheet names are shared).
+    Supports the same item access as the original dict row objects:
+    obj["row"], obj["row_num"] and obj["parent_sheet"].
+    """
+
+    __slots__ = ("row", "row_num", "parent_sheet")
+
+    def __init__(self, row, row_num, parent_sheet):
+        self.row = row
+        self.row_num = row_num
+        self.parent_sheet = parent_sheet
+
+    def __getitem__(self, key):
+        if key not in CachedRow.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in CachedRow.__slots__ else default
+
+    def keys(self):
+        return CachedRow.__slots__
+
+    def __eq__(self, other):
+        return all(self[key] == other[key] for key in CachedRow.__slots__)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def strip_accents(s):
+    """ Strips the unicode accents (diacritics) from a string. """
+    return ''.join(c for c in unicodedata.normalize('NFD', s)
+                   if unicodedata.category(c) != 'Mn')
+
+
+def normalize_search(text):
+    """ Search normalization: no accents, lowercase, words separated by single spaces. """
+    return " ".join(re.split(r"[\W_]+", strip_accents(text).lower())).strip()
+
+
+def trigrams(text):
+    """ Returns the set of (word boundary padded) trigrams of a normalized text. """
+    grams = set()
+    for word in text.split():
+        padded = "  " + word + " "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def search_text(*values):
+    """ Returns the normalized search text of a row (from its indexed column values). """
+    return normalize_search(" ".join(value for value in values if value)) or None
+
+
+def index_values(row, columnMap):
+    """ Returns the (stripped) values of the indexed columns for a row. """
+    values = []
+    for name in INDEXED_COLUMNS:
+        idx = columnMap.get(name)
+        values.append(row[idx].strip() if idx is not None and idx < len(row) else None)
+    return values
+
+
+class GradebookCache:
+    """
+    Gradebook data cache backed by a SQLite database.
+
+    The data object format is the same as the one returned by fetch_data:
+    {"values": [{"row": [...], "row_num": N, "parent_sheet": "Sheet"}, ...],
+     "meta": {"Sheet": sheet_info, ...}}
+    (the row objects are CachedRow instances, accessed like the dicts above).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.create_function("search_text", len(INDEXED_COLUMNS), search_text,
+                                  deterministic=True)
+        self._migrate()
+        self._memo = None
+
+    def _migrate(self):
+        """ Creates / upgrades the database schema. """
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        fresh = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'rows'").fetchone() is None
+        with self.conn:
+            if not fresh:
+                for target in range(version + 1, SCHEMA_VERSION + 1):
+                    for statement in MIGRATIONS[target]:
+                        self.conn.execute(statement)
+            self.conn.executescript(SCHEMA)
+            self.conn.execute("PRAGMA user_version = %d" % (SCHEMA_VERSION,))
+
+    def close(self):
+        self.conn.close()
+
+    def get_prop(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM props WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_prop(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO props (key, value) VALUES (?, ?)",
+                          (key, json.dumps(value)))
+
+    def _bump_generation(self):
+        """ Marks the cached data as modified (invalidates in-memory copies). """
+        self.set_prop("generation", self.get_prop("generation", 0) + 1)
+
+    def get_change_tokens(self):
+        """ Returns the change tokens recorded by the last full download (see set_change_tokens). """
+        return self.get_prop("change_tokens", {})
+
+    def set_change_tokens(self, **tokens):
+        """
+        Records the remote spreadsheet's state tokens (e.g., the change check
+        range's and the downloaded content's hashes); call without arguments
+        to invalidate them.
+        """
+        with self.conn:
+            self.set_prop("change_tokens", tokens)
+
+    def has_data(self):
+        return self.conn.execute("SELECT 1 FROM meta LIMIT 1").fetchone() is not None
+
+    def replace(self, data):
+        """
+        Replaces the whole cache contents with the given data object.
+        Pre-rendered listing lines are kept for the unchanged rows.
+        """
+        with self.conn:
+            self.conn.execute("DROP TABLE IF EXISTS temp.old_rows")
+            # (keyed, so the listing lookups below don't scan the whole table)
+            self.conn.execute(
+                "CREATE TEMP TABLE old_rows (sheet TEXT, row_num INTEGER, row TEXT, info TEXT, "
+                "listing TEXT, PRIMARY KEY (sheet, row_num)) WITHOUT ROWID")
+            self.conn.execute(
+                "INSERT INTO old_rows SELECT r.sheet, r.row_num, r.row, m.info, r.listing "
+                "FROM rows r JOIN meta m ON m.sheet = r.sheet WHERE r.listing IS NOT NULL")
+            self.conn.execute("DELETE FROM meta")
+            self.conn.execute("DELETE FROM rows")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO meta (sheet, pos, info) VALUES (?, ?, ?)",
+                ((sheet, pos, json.dumps(info))
+                 for pos, (sheet, info) in enumerate(data["meta"].items())))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO rows (sheet, row_num, row, username, fullname, search) "
+                "VALUES (?, ?, ?, ?, ?, search_text(?, ?))",
+                ((obj["parent_sheet"], obj["row_num"], json.dumps(obj["row"]),
+                  *(index_values(obj["row"], data["meta"][obj["parent_sheet"]]["columnMap"]) * 2))
+                 for obj in data["values"]))
+            self.conn.execute(
+                "UPDATE rows SET listing = (SELECT o.listing FROM old_rows o JOIN meta m "
+                "ON m.sheet = o.sheet WHERE o.sheet = rows.sheet AND o.row_num = rows.row_num "
+                "AND o.row = rows.row AND o.info = m.info)")
+            self.conn.execute("DROP TABLE old_rows")
+            self._bump_generation()
+        self._memo = None
+
+    def update_row(self, sheet, row_num, row, columnMap):
+        """ Patches a single row (removes it if its first column became empty). """
+        self.update_rows([(sheet, row_num, row, columnMap)])
+
+    def update_rows(self, entries):
+        """ Patches multiple rows, given as (sheet, row_num, row, columnMap) tuples. """
+        with self.conn:
+            for sheet, row_num, row, columnMap in entries:
+                if row and row[0]:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO rows (sheet, row_num, row, username, fullname, "
+                        "search) VALUES (?, ?, ?, ?, ?, search_text(?, ?))",
+                        (sheet, row_num, json.dumps(row), *(index_values(row, columnMap) * 2)))
+                else:
+                    self.conn.execute("DELETE FROM rows WHERE sheet = ? AND row_num = ?",
+                                      (sheet, row_num))
+            self._bump_generation()
+
+    def get_meta(self):
+        """ Returns the per-sheet metadata (without loading any rows). """
+        return {sheet: json.loads(info) for sheet, info in self.conn.execute(
+            "SELECT sheet, info FROM meta ORDER BY pos")}
+
+    def load(self):
+        """
+        Loads all rows (the result is reused while the cache is unchanged).
+        For compactness, the rows are (shared, read-only) tuples and the
+        repeated cell values (e.g., grades) are stored only once.
+        """
+        generation = self.get_prop("generation", 0)
+        if self._memo and self._memo[0] == generation:
+            return self._memo[1]
+        data = {"values": [], "meta": self.get_meta()}
+        sheets = {sheet: sheet for sheet in data["meta"]}
+        strings = {}
+        cursor = self.conn.execute(
+            "SELECT r.sheet, r.row_num, r.row FROM rows r JOIN meta m ON m.sheet = r.sheet "
+            "ORDER BY m.pos, r.row_num")
+        append = data["values"].append
+        for sheet, row_num, row in cursor:
+            row = tuple([strings.setdefault(value, value) for value in json.loads(row)])
+            append(CachedRow(row, row_num, sheets[sheet]))
+        self._memo = (generation, data)
+        return data
+
+    def get_row(self, sheet, row_num):
+        """ Returns the cached row object at the given position (or None). """
+        res = self.conn.execute("SELECT row FROM rows WHERE sheet = ? AND row_num = ?",
+                                (sheet, row_num)).fetchone()
+        if not res:
+            return None
+        return CachedRow(json.loads(res[0]), row_num, sheet)
+
+    def find_rows(self, column, value):
+        """ Returns the row objects having an indexed column equal to value. """
+        if column not in INDEXED_COLUMNS:
+            raise ValueError("Column not indexed: '%s'" % (column,))
+        cursor = self.conn.execute(
+            "SELECT sheet, row_num, row FROM rows WHERE %s = ?" % (column,), (value,))
+        return [CachedRow(json.loads(row), row_num, sheet) for sheet, row_num, row in cursor]
+
+    def clear_listing(self, listing_format):
+        """ Invalidates all pre-rendered listing lines (e.g., on format change). """
+        with self.conn:
+            self.conn.execute("UPDATE rows SET listing = NULL")
+            self.set_prop("listing_format", listing_format)
+
+    def get_unrendered_rows(self):
+        """ Returns the row objects without a pre-rendered listing line. """
+        cursor = self.conn.execute(
+            "SELECT sheet, row_num, row FROM rows WHERE listing IS NULL")
+        return [CachedRow(json.loads(row), row_num, sheet) for sheet, row_num, row in cursor]
+
+    def set_listing(self, entries):
+        """ Stores the rendered listing lines, given as (line, sheet, row_num) tuples. """
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE rows SET listing = ? WHERE sheet = ? AND row_num = ?", entries)
+
+    def get_listing(self):
+        """ Returns all pre-rendered listing lines (in gradebook order). """
+        return [line for (line,) in self.conn.execute(
+            "SELECT r.listing FROM rows r JOIN meta m ON m.sheet = r.sheet "
+            "ORDER BY m.pos, r.row_num")]
+
+    def is_listing_outdated(self):
+        """ Returns whether the cache was modified since the listing file was last written. """
+        return self.get_prop("listing_generation") != self.get_prop("generation", 0)
+
+    def set_listing_written(self):
+        """ Records that the listing file was written (at the current generation). """
+        with self.conn:
+            self.set_prop("listing_generation", self.get_prop("generation", 0))
+
+    def _get_posting(self, gram):
+        """ Returns the ids of the search texts containing a trigram (as an array). """
+        row = self.conn.execute("SELECT text_ids FROM search_grams WHERE gram = ?",
+                                (gram,)).fetchone()
+        ids = array.array("I")
+        if row:
+            ids.frombytes(row[0])
+        return ids
+
+    def refresh_search_index(self):
+        """
+        Brings the trigram search index up to date (incrementally: only the new
+        search texts are indexed, the ones no longer used are removed).
+        Returns the number of newly indexed texts.
+        """
+        generation = self.get_prop("generation", 0)
+        if self.get_prop("search_generation") == generation:
+            return 0
+        with self.conn:
+            removed = self.conn.execute(
+                "SELECT id, text FROM search_texts t WHERE NOT EXISTS "
+                "(SELECT 1 FROM rows r WHERE r.search = t.text)").fetchall()
+            self.conn.executemany("DELETE FROM search_texts WHERE id = ?",
+                                  ((text_id,) for text_id, _ in removed))
+            new_texts = [text for (text,) in self.conn.execute(
+                "SELECT DISTINCT search FROM rows r WHERE search IS NOT NULL AND NOT EXISTS "
+                "(SELECT 1 FROM search_texts t WHERE t.text = r.search)")]
+            # gram -> (added text ids, removed text ids)
+            changes = {}
+            for text_id, text in removed:
+                for gram in trigrams(text):
+                    changes.setdefault(gram, ([], set()))[1].add(text_id)
+            for text in new_texts:
+                text_id = self.conn.execute("INSERT INTO search_texts (text) VALUES (?)",
+                                            (text,)).lastrowid
+                for gram in trigrams(text):
+                    changes.setdefault(gram, ([], set()))[0].append(text_id)
+            for gram, (added, dropped) in changes.items():
+                ids = self._get_posting(gram)
+                if dropped:
+                    ids = array.array("I", (text_id for text_id in ids if text_id not in dropped))
+                ids.extend(added)
+                if ids:
+                    self.conn.execute("INSERT OR REPLACE INTO search_grams (gram, text_ids) "
+                                      "VALUES (?, ?)", (gram, ids.tobytes()))
+                else:
+                    self.conn.execute("DELETE FROM search_grams WHERE gram = ?", (gram,))
+            self.set_prop("search_generation", generation)
+        return len(new_texts)
+
+    def search(self, query, limit=10, min_score=0.5):
+        """
+        Searches the rows by their (accent-insensitive) username / full name.
+        Returns a list of (score, row object) tuples, best matches first; the
+        score is the fraction of the query's trigrams found in the row's text.
+        """
+        grams = trigrams(normalize_search(query))
+        if not grams:
+            return []
+        postings = sorted((self._get_posting(gram) for gram in grams), key=len)
+        # a text scoring at least min_score contains at least `needed` of the
+        # query's trigrams, thus one of its (n - needed + 1) rarest ones
+        needed = max(1, math.ceil(min_score * len(grams) - 1e-9))
+        candidates = set()
+        for ids in postings[:len(grams) - needed + 1]:
+            candidates.update(ids)
+        scores = dict.fromkeys(candidates, 0)
+        for ids in postings:
+            for text_id in candidates.intersection(ids):
+                scores[text_id] += 1
+        best = sorted((text_id for text_id, count in scores.items() if count >= needed),
+                      key=lambda text_id: (-scores[text_id], text_id))
+        results = []
+        for text_id in best:
+            if len(results) >= limit:
+                break
+            for sheet, row_num, row in self.conn.execute(
+                    "SELECT r.sheet, r.row_num, r.row FROM search_texts t JOIN rows r "
+                    "ON r.search = t.text WHERE t.id = ? ORDER BY r.sheet, r.row_num", (text_id,)):
+                results.append((scores[text_id] / len(grams),
+                                CachedRow(json.loads(row), row_num, sheet)))
+        return results[:limit]
+
+    def get_column_map(self, key):
+        """ Returns a memoized header mapping (or None). """
+        row = self.conn.execute("SELECT column_map FROM column_maps WHERE key = ?",
+                                (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_column_map(self, key, columnMap):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO column_maps (key, column_map) VALUES (?, ?)",
+                              (key, json.dumps(columnMap)))
+
+    def queue_writes(self, data_map):
+        """
+        Journals cell writes for later (batched) sending.
+        Repeated writes to the same cell replace the previous (unsent) value.
+        """
+        now = time.time()
+        with self.conn:
+            seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM pending").fetchone()[0]
+            for a1, values in data_map.items():
+                seq += 1
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO pending (a1, vals, queued_at, seq) VALUES (?, ?, ?, ?)",
+                    (a1, json.dumps(values), now, seq))
+
+    def get_pending(self):
+        """ Returns the queued writes (in the order they were last written). """
+        return [{"a1": a1, "values": json.loads(vals), "queued_at": queued_at, "seq": seq}
+                for a1, vals, queued_at, seq in self.conn.execute(
+                    "SELECT a1, vals, queued_at, seq FROM pending ORDER BY seq")]
+
+    def remove_pending(self, entries):
+        """ Removes sent writes (unless they were overwritten in the meantime). """
+        with self.conn:
+            self.conn.executemany("DELETE FROM pending WHERE a1 = ? AND seq = ?",
+                                  ((entry["a1"], entry["seq"]) for entry in entries))
+
+    def migrate_json(self, json_file):
+        """ Imports the data from a legacy JSON cache file. """
+        with open(json_file, "r") as f:
+            data = json.load(f)
+        self.replace(data)
+
+
+_open_caches = {}
+
+def open_cache(cache_file):
+    """
+    Opens (or reuses the already opened) cache database.
+    Legacy '.json' caches are automatically migrated on first use.
+    """
+    db_path = os.path.abspath(cache_db_path(cache_file))
+    cache = _open_caches.get(db_path)
+    if cache:
+        return cache
+    cache = GradebookCache(db_path)
+    if cache_file.endswith(".json") and os.path.exists(cache_file) and not cache.has_data():
+        cache.migrate_json(cache_file)
+    _open_caches[db_path] = cache
+    return cache
@@ -0,0 +1,135 @@
+# Per-phase timing instrumentation for gsheet-tool.py.
+# Code sections are timed using `with phase("name"):` and events counted
+# using count(); nothing is recorded unless enable() was called (see the
+# --profile option). Phase times are cumulative (phases may nest and may run
+# in several threads at once, e.g. the concurrent API requests).
+
+import json
+import os
+import sys
+import threading
+import time
+
+_lock = threading.Lock()
+_enabled = False
+_phases = {}
+_counters = {}
+
+
+class phase:
+    """ Context manager timing a named phase (no-op when disabled). """
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if _enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None:
+            add_phase(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def add_phase(name, seconds):
+    with _lock:
+        entry = _phases.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+
+def count(name, value=1):
+    """ Increments a counter (e.g., bytes transferred). """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def process_age():
+    """ Returns the seconds elapsed since the process started (Linux only, else None). """
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return max(0.0, uptime - start_ticks / os.sysconf("SC_CLK_TCK"))
+
+
+def enable(script_start=None):
+    """
+    Starts recording. If given, script_start (the perf_counter() value at the
+    top of the script) is used to report the interpreter startup and the
+    module import times.
+    """
+    global _enabled
+    _enabled = True
+    if script_start is not None:
+        imports = time.perf_counter() - script_start
+        add_phase("imports", imports)
+        age = process_age()
+        if age is not None:
+            add_phase("startup", max(0.0, age - imports))
+
+
+def disable():
+    """ Stops recording (e.g., after a profiled request served by a long-lived process). """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """ Clears the recorded phases / counters (e.g., between served commands). """
+    with _lock:
+        _phases.clear()
+        _counters.clear()
+
+
+class CountingHttp:
+    """ Wraps an httplib2-compatible object, timing the requests and counting the bytes. """
+
+    def __init__(self, http):
+        self.http = http
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        with phase("http"):
+            resp, content = self.http.request(uri, method, body, headers, *args, **kwargs)
+        count("http_requests")
+        count("bytes_sent", len(body) if body else 0)
+        count("bytes_received", len(content) if content else 0)
+        return resp, content
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+
+def write_report(dest, command=None, extra=None):
+    """
+    Writes the recorded phases / counters as JSON lines to dest (a file path,
+    appended to, or '-' for stderr).
+    """
+    run = "%d-%d" % (time.time() * 1000, os.getpid())
+    with _lock:
+        lines = [{"run": run, "time": time.time(), "command": command}]
+        lines.extend({"run": run, "phase": name, "calls": calls, "seconds": round(seconds, 6)}
+                     for name, (calls, seconds) in sorted(_phases.items()))
+        counters = dict(_counters)
+    counters.update(extra or {})
+    lines.append({"run": run, "counters": counters})
+    text = "".join(json.dumps(line) + "\n" for line in lines)
+    if dest == "-":
+        sys.stderr.write(text)
+    else:
+        with open(os.path.expanduser(dest), "a") as f:
+            f.write(text)
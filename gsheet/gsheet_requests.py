@@ -0,0 +1,121 @@
+# Sheets API request scheduler for gsheet-tool.py.
+# All API calls go through a RequestScheduler, which enforces the per-minute
+# quota (token bucket), retries on 429 / 5xx / network errors (exponential
+# backoff with jitter), limits the number of concurrent requests and collects
+# metrics.
+
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# HTTP status codes worth retrying
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """ Thread-safe token bucket rate limiter. """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1, rate_per_minute // 6)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Takes a token (waiting for one, if needed); returns the time waited. """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+def is_retryable(exc):
+    """ Checks whether a failed request should be retried. """
+    resp = getattr(exc, "resp", None)  # googleapiclient.errors.HttpError
+    if resp is not None:
+        return getattr(resp, "status", None) in RETRY_STATUSES
+    return isinstance(exc, (ConnectionError, TimeoutError, socket.timeout, socket.gaierror))
+
+
+class RequestScheduler:
+    """
+    Executes googleapiclient requests with rate limiting, retries and a
+    concurrency limit.
+    Use `execute(request)` for a single request or `execute_all(requests)`
+    to run multiple (independent) requests concurrently.
+    """
+
+    def __init__(self, requests_per_minute=60, max_retries=5, backoff_base=1.0,
+                 backoff_max=32.0, max_concurrency=2, http_factory=None):
+        self.bucket = TokenBucket(requests_per_minute)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_concurrency = max(1, max_concurrency)
+        self.semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        # httplib2 objects are not thread-safe: each thread gets its own
+        self.http_factory = http_factory
+        self._local = threading.local()
+        self.metrics_lock = threading.Lock()
+        self.metrics = {"requests": 0, "retries": 0, "errors": 0,
+                        "throttled_seconds": 0.0, "backoff_seconds": 0.0}
+
+    def _count(self, name, value=1):
+        with self.metrics_lock:
+            self.metrics[name] += value
+
+    def _http(self):
+        if not self.http_factory:
+            return None
+        if not hasattr(self._local, "http"):
+            self._local.http = self.http_factory()
+        return self._local.http
+
+    def backoff_delay(self, attempt):
+        """ Exponential backoff with (full) jitter. """
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def execute(self, request, retry=True):
+        """ Executes a single request (retrying on transient errors, unless disabled). """
+        with self.semaphore:
+            attempt = 0
+            while True:
+                self._count("throttled_seconds", self.bucket.acquire())
+                self._count("requests")
+                try:
+                    http = self._http()
+                    return request.execute(http=http) if http else request.execute()
+                except Exception as e:
+                    if not retry or attempt >= self.max_retries or not is_retryable(e):
+                        self._count("errors")
+                        raise
+                    delay = self.backoff_delay(attempt)
+                    self._count("retries")
+                    self._count("backoff_seconds", delay)
+                    time.sleep(delay)
+                    attempt += 1
+
+    def execute_all(self, requests, retry=True):
+        """ Executes multiple requests concurrently; returns the results (in order). """
+        requests = list(requests)
+        if len(requests) <= 1 or self.max_concurrency == 1:
+            return [self.execute(request, retry) for request in requests]
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            return list(pool.map(lambda request: self.execute(request, retry), requests))
+
+    def format_metrics(self):
+        with self.metrics_lock:
+            return ("API requests: %(requests)d, retries: %(retries)d, errors: %(errors)d, "
+                    "throttled: %(throttled_seconds).2fs, backoff: %(backoff_seconds).2fs"
+                    % self.metrics)
@@ -4,55 +4,85 @@ Moodle workbook date/time conversion script.
 
 Parses the dates from a grading workbook into standard 'YYYY-MM-DD HH:MM' format,
 which is easier to parse in scripts.
+Rows are converted as they are read, so it can also be used inside a pipe
+(use '-' for stdin / stdout).
 
-Invocation: moodle-conv-tool.py [options] INPUT_CSV OUTPUT_CSV 
+Invocation: moodle-conv-tool.py [options] INPUT_CSV OUTPUT_CSV
 """
 import sys
 import argparse
 import csv
+import functools
+import itertools
 from datetime import datetime
 
 # "Friday, 26 May 2023, 12:44 PM"
 DEF_DATE_FORMAT = "%A, %d %B %Y, %I:%M %p"
 DEF_COLUMN_NAME = "Last modified (submission)"
 OUT_DATE_FORMAT = "%Y-%m-%d %H:%M"
+# max. number of distinct date strings to remember (most submissions share
+# a handful of timestamps near the deadline)
+DATE_CACHE_SIZE = 4096
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def convert_date(date_str, format=DEF_DATE_FORMAT):
+    """ Converts a Moodle date string (memoized); returns None for empty dates. """
+    date_str = date_str.strip()
+    if date_str == "" or date_str == "-":
+        return None
+    pdate = datetime.strptime(date_str, format)
+    return pdate.strftime(OUT_DATE_FORMAT)
+
+
+def convert_csv_rows(rows, column_names, format=DEF_DATE_FORMAT):
+    """
+    Generator converting the date columns of the given CSV rows (the first
+    one must be the header).
+    """
+    date_col_idxs = None
+    for line in rows:
+        if date_col_idxs is None:  # header row
+            try:
+                date_col_idxs = [line.index(name) for name in column_names]
+            except ValueError:
+                sys.stderr.write("Cannot find columns named %s in input csv!\n" % (column_names,))
+                sys.exit(1)
+            yield line
+            continue
+        if len(line) < 2:
+            continue
+        for date_col_idx in date_col_idxs:
+            line[date_col_idx] = convert_date(line[date_col_idx], format)
+        yield line
 
 
 def moodle_convert_csv_dates(input_csv, output_csv, column_name=DEF_COLUMN_NAME,
                              format=DEF_DATE_FORMAT):
-    """ 
-    Opens the input csv and converts the date column to a parseable 'YYYY-MM-DD HH:MM' format.
     """
-    date_col_idx = None
-    lines = []
-    with open(input_csv, newline='') as f:
-        csvr = csv.reader(f, delimiter=',')
-        for idx, line in enumerate(csvr):
-            if idx == 0:  # header row
-                try:
-                    date_col_idx = line.index(column_name)
-                except ValueError:
-                    sys.stderr.write("Cannot find column named '%s' in input csv!" % column_name)
-                    sys.exit(1)
-                lines.append(line)
-                continue
-            if len(line) < 2:
-                continue
-            # line = list(line)
-            date_str = line[date_col_idx].strip()
-            if date_str == "" or date_str == "-":
-                date_str = None
-            else:
-                pdate = datetime.strptime(date_str, format)
-                date_str = pdate.strftime(OUT_DATE_FORMAT)
-            line[date_col_idx] = date_str
-            lines.append(line)
-    
-    if output_csv == None:
-        return lines
-    with open(output_csv, "w") as out:
-        csvw = csv.writer(out, delimiter=",")
-        csvw.writerows(lines)
+    Opens the input csv and converts the date column(s) to a parseable 'YYYY-MM-DD HH:MM' format.
+    The rows are returned as list if no output file is given.
+    """
+    column_names = [column_name] if isinstance(column_name, str) else list(column_name)
+    f = sys.stdin if input_csv == "-" else open(input_csv, newline='')
+    try:
+        rows = convert_csv_rows(csv.reader(f, delimiter=','), column_names, format)
+        # check the header before creating the output file
+        header = next(rows, None)
+        if header is not None:
+            rows = itertools.chain([header], rows)
+        if output_csv == None:
+            return list(rows)
+        out = sys.stdout if output_csv == "-" else open(output_csv, "w", newline='')
+        try:
+            csvw = csv.writer(out, delimiter=",")
+            csvw.writerows(rows)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    finally:
+        if f is not sys.stdin:
+            f.close()
 
 
 if __name__ == "__main__":
@@ -60,13 +90,13 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(
             description="Converts the date column of a Moodle Grading Worksheet to a parseable " +
             "'YYYY-MM-DD HH:MM' format.")
-    parser.add_argument("input_csv", help="Path to the grading worksheet to read.")
-    parser.add_argument("output_csv", help="Path to output csv file.")
-    parser.add_argument("--column", nargs=1, default=DEF_COLUMN_NAME,
-                        help="Column name which contains the date to be converted.")
-    parser.add_argument("--format", nargs=1, default=DEF_DATE_FORMAT,
+    parser.add_argument("input_csv", help="Path to the grading worksheet to read ('-' for stdin).")
+    parser.add_argument("output_csv", help="Path to output csv file ('-' for stdout).")
+    parser.add_argument("--column", action="append",
+                        help="Column name which contains the date to be converted " +
+                        "(may be given multiple times; default: '%s')." % DEF_COLUMN_NAME)
+    parser.add_argument("--format", default=DEF_DATE_FORMAT,
                         help="Current date format to parse (defaults to 'Weekday, DD Month 20xx, HH:MM AM/PM')")
     args = parser.parse_args()
     moodle_convert_csv_dates(args.input_csv, args.output_csv,
-                             column_name=args.column, format=args.format)
-
+                             column_name=(args.column or [DEF_COLUMN_NAME]), format=args.format)
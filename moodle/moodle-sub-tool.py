@@ -9,6 +9,20 @@ download it from View All Submission -> Download Grading Worksheet.
 
 Grading directories must be named as '<Full Name>_<ID>_<submission suffix>'.
 
+Alternatively, the "Download all submissions" zip may be given using
+`--from-zip`: its entries are then written straight to their final (renamed,
+extracted and flattened) paths, without unpacking the bulk zip first.
+
+The processing state is recorded in a manifest ('.moodle-sub-tool.json') inside
+the submissions directory, so the script can be re-run safely: already
+processed submissions are skipped, interrupted runs resume and changed (e.g.,
+late) re-downloads replace the old copy (kept as '<name>.prev'), while the
+unchanged copies of already processed submissions are removed.
+
+With `--dedup`, identical submission archives (e.g., the same project uploaded
+by all team members) are extracted only once and hard-linked into the other
+directories; the groups of duplicates are reported, so they can be graded once.
+
 Invocation: moodle-sub-tool.py [options] <submissions dir> <grading csv>
 """
 
@@ -17,15 +31,25 @@ import os
 import os.path
 import shutil
 import csv
+import hashlib
+import json
 import re
 import traceback
+import tarfile
+import tempfile
 import zipfile
 import unicodedata
 import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 
 submission_dir_re = re.compile(r'^(?P<lname>[a-zA-Z0-9 -]+)\s+(?P<fname>[A-Z0-9-]+)_(?P<id>[0-9]+)_')
-archive_formats = ['zip', 'tar', 'tar.gz', 'tar.bz', 'tar.xz']  # avoid students trolling
+archive_formats = ['zip', 'tar', 'tar.gz', 'tgz', 'tar.bz', 'tar.bz2', 'tar.xz']  # avoid students trolling
+# nested archives read from a bulk zip are buffered in memory up to this size
+SPOOL_MAX_SIZE = 64 * 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+# processing manifest (stored inside the submissions directory)
+MANIFEST_FILE = ".moodle-sub-tool.json"
 
 
 def strip_accents(s):
@@ -88,10 +112,455 @@ def extract_archive(archive_file, dest_dir):
                     shutil.move(entry.path, dest_dir)
 
 
+def submission_new_name(sub_dir, rename_type, students_map):
+    """
+    Computes the new name of a submission directory using the given rename
+    method (returns None if it shouldn't / couldn't be renamed).
+    """
+    norm_name = strip_accents(sub_dir)
+    re_matches = submission_dir_re.match(norm_name)
+    if not re_matches:
+        return None
+    new_name = None
+    student_obj = search_moodle_username(re_matches.group("id"), students_map)
+    email = None
+    if student_obj:
+        email = student_obj["email"]
+    if rename_type in ("email", "username"):
+        if email:
+            if rename_type == "username":
+                email = re.sub(r'@\S+$', '', email)
+            new_name = email
+    elif rename_type == "fname":
+        # rename to  first_name + last_name
+        new_name = re_matches["fname"] + " " + re_matches["lname"]
+    elif rename_type == "fname_user":
+        # rename to  first_name + last_name + (username)
+        new_name = re_matches["fname"] + " " + re_matches["lname"]
+        if email:
+            email = re.sub(r'@\S+$', '', email)
+            new_name += " (" + email + ")"
+    return new_name
+
+
+class Manifest:
+    """
+    Records the processing state of each submission (original name, new name,
+    content signature, extraction status), so interrupted runs / re-downloads
+    only process the new or changed submissions.
+    """
+
+    def __init__(self, rdir, dry_run=False):
+        self.path = os.path.join(rdir, MANIFEST_FILE)
+        self.dry_run = dry_run
+        self.submissions = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.submissions = json.load(f).get("submissions", {})
+        self.by_new_name = {entry["new_name"]: original
+                            for original, entry in self.submissions.items()}
+
+    def get(self, original):
+        return self.submissions.get(original)
+
+    def find_by_new_name(self, new_name):
+        """ Returns the original name of an already renamed submission (or None). """
+        return self.by_new_name.get(new_name)
+
+    def record(self, original, **fields):
+        """ Updates a submission's entry and saves the manifest. """
+        entry = self.submissions.setdefault(original, {})
+        if "new_name" in fields and entry.get("new_name") != fields["new_name"]:
+            self.by_new_name.pop(entry.get("new_name"), None)
+            self.by_new_name[fields["new_name"]] = original
+        entry.update(fields)
+        self.save()
+
+    def save(self):
+        if self.dry_run:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": 1, "submissions": self.submissions}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def file_hash(path):
+    """ Returns the SHA-256 hash of a file (read in chunks). """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def dir_signature(path):
+    """ Returns a content signature of a (downloaded) submission directory. """
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            full_path = os.path.join(root, name)
+            h.update(os.path.relpath(full_path, path).encode() + b"\0")
+            h.update(file_hash(full_path).encode())
+    return "sha256:" + h.hexdigest()
+
+
+def hash_files(paths, num_workers=1):
+    """
+    Returns the content hashes of the given files (as a {path: hash} dict).
+    Only the files having the same size as another one are actually read (in
+    parallel); the others get a size-based (unique) key.
+    """
+    by_size = {}
+    for path in paths:
+        by_size.setdefault(os.path.getsize(path), []).append(path)
+    hashes = {}
+    to_hash = []
+    for size, group in by_size.items():
+        if len(group) == 1:
+            hashes[group[0]] = "size:{}".format(size)
+        else:
+            to_hash.extend(group)
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as pool:
+        for path, digest in zip(to_hash, pool.map(file_hash, to_hash)):
+            hashes[path] = digest
+    return hashes
+
+
+def link_tree(src_dir, dest_dir):
+    """
+    Populates dest_dir with hard links to the files inside src_dir (falls back
+    to copying them if linking is not possible, e.g. across filesystems).
+    """
+    for root, dirs, files in os.walk(src_dir):
+        dest_root = os.path.join(dest_dir, os.path.relpath(root, src_dir))
+        os.makedirs(dest_root, exist_ok=True)
+        for name in files:
+            src_path = os.path.join(root, name)
+            dest_path = os.path.join(dest_root, name)
+            try:
+                os.link(src_path, dest_path)
+            except OSError:
+                shutil.copy2(src_path, dest_path)
+
+
+def print_duplicates_report(groups):
+    """ Prints the groups of identical submissions (given as lists of names). """
+    groups = [group for group in groups if len(group) > 1]
+    if not groups:
+        return
+    print("Identical submissions ({} groups, extracted once):".format(len(groups)))
+    for group in groups:
+        print("  '{}' == {}".format(group[0], ", ".join("'{}'".format(name) for name in group[1:])))
+
+
+def keep_previous(path):
+    """ Moves an older version of a submission out of the way (as '<path>.prev'). """
+    prev_path = path + ".prev"
+    if os.path.exists(prev_path):
+        shutil.rmtree(prev_path)
+    os.rename(path, prev_path)
+    print("Keeping previous version of '{}' as '{}'".format(path, prev_path))
+
+
+def extract_job(archive_file, dest_dir):
+    """
+    Process pool worker: extracts an archive, returning the formatted
+    traceback on failure (or None).
+    """
+    try:
+        extract_archive(archive_file, dest_dir)
+    except:
+        return traceback.format_exc()
+    return None
+
+
+def run_extract_jobs(jobs, num_workers, on_done=None):
+    """
+    Extracts the (archive file, destination dir, submission) jobs using a
+    process pool, reporting each directory as soon as it's done (the
+    `on_done(submission, success)` callback is also called).
+    """
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        futures = {pool.submit(extract_job, archive_file, dest_dir): (archive_file, submission)
+                   for archive_file, dest_dir, submission in jobs}
+        for future in as_completed(futures):
+            archive_file, submission = futures[future]
+            error = future.result()
+            if error:
+                print("unzip: FAILED '{}'".format(archive_file))
+                sys.stderr.write(error)
+            else:
+                print("unzip: '{}'".format(archive_file))
+            if on_done:
+                on_done(submission, not error)
+
+
+class SubmissionLimitError(Exception):
+    """ Raised when a submission exceeds the extraction size / file count limits. """
+
+
+class ExtractLimits:
+    """ Tracks the (per-submission) number of files and bytes written to disk. """
+
+    def __init__(self, max_size, max_files):
+        self.max_size = max_size
+        self.max_files = max_files
+        self.size = 0
+        self.files = 0
+
+    def check_declared(self, total_size, num_files):
+        """ Checks the sizes declared by the archive, before extracting anything. """
+        if self.max_files and num_files > self.max_files:
+            raise SubmissionLimitError("too many files ({} > {})".format(num_files, self.max_files))
+        if self.max_size and total_size > self.max_size:
+            raise SubmissionLimitError("too large ({} > {} bytes)".format(total_size, self.max_size))
+
+    def add_file(self):
+        self.files += 1
+        self.check_declared(self.size, self.files)
+
+    def add_bytes(self, size):
+        self.size += size
+        self.check_declared(self.size, self.files)
+
+
+def safe_member_path(name):
+    """
+    Splits an archive member's path into components.
+    Returns None for absolute paths / paths escaping the destination.
+    """
+    name = name.replace("\\", "/")
+    parts = [part for part in name.split("/") if part not in ("", ".")]
+    if not parts or name.startswith("/") or ".." in parts:
+        return None
+    return parts
+
+
+def is_archive(filename):
+    return filename.lower().endswith(tuple("." + ext for ext in archive_formats))
+
+
+def copy_limited(src, dest_path, limits):
+    """ Streams a file object to the destination path, enforcing the limits. """
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+    limits.add_file()
+    with open(dest_path, "wb") as out:
+        while True:
+            chunk = src.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            limits.add_bytes(len(chunk))
+            out.write(chunk)
+
+
+def extract_entries(entries, dest_dir, limits):
+    """
+    Writes the (path components, size, open function) archive entries to the
+    destination; if they're all inside a single directory, it's flattened.
+    """
+    limits.check_declared(sum(size for _, size, _ in entries), len(entries))
+    if entries and all(len(parts) > 1 and parts[0] == entries[0][0][0]
+                       for parts, _, _ in entries):
+        entries = [(parts[1:], size, open_fn) for parts, size, open_fn in entries]
+    for parts, _, open_fn in entries:
+        with open_fn() as src:
+            copy_limited(src, os.path.join(dest_dir, *parts), limits)
+
+
+def extract_nested_archive(src, filename, dest_dir, limits):
+    """
+    Extracts an archive read from a (non-seekable) stream straight to its
+    final destination (flattening it, like extract_archive).
+    """
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+        while True:
+            chunk = src.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            spool.write(chunk)
+            limits.check_declared(spool.tell(), 0)
+        spool.seek(0)
+        if filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(spool) as zf:
+                entries = []
+                for info in zf.infolist():
+                    parts = safe_member_path(info.filename)
+                    if info.is_dir():
+                        continue
+                    if not parts:
+                        print("unzip: IGNORE unsafe path '{}'".format(info.filename))
+                        continue
+                    entries.append((parts, info.file_size,
+                                    lambda info=info: zf.open(info)))
+                extract_entries(entries, dest_dir, limits)
+        else:
+            with tarfile.open(fileobj=spool, mode="r:*") as tf:
+                entries = []
+                for member in tf.getmembers():
+                    parts = safe_member_path(member.name)
+                    if not member.isfile():
+                        continue  # note: links / devices are never extracted
+                    if not parts:
+                        print("unzip: IGNORE unsafe path '{}'".format(member.name))
+                        continue
+                    entries.append((parts, member.size,
+                                    lambda member=member: tf.extractfile(member)))
+                extract_entries(entries, dest_dir, limits)
+
+
+def zip_members_signature(members):
+    """ Content signature of a submission inside the bulk zip (from the CRCs, no reading). """
+    h = hashlib.sha256()
+    for parts, info in sorted(members, key=lambda member: member[0]):
+        h.update("{}:{:08x}:{}\0".format("/".join(parts), info.CRC, info.file_size).encode())
+    return "zip:" + h.hexdigest()
+
+
+def zip_member_hash(bulk, info):
+    """ Returns the SHA-256 hash of a bulk zip member (read in chunks). """
+    h = hashlib.sha256()
+    with bulk.open(info) as src:
+        while True:
+            chunk = src.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def zip_duplicate_keys(bulk, submissions):
+    """
+    Returns content keys for the single-archive submissions inside the bulk zip
+    (as a {submission: key} dict, only for the ones having identical copies).
+    Candidates are found by CRC and size, then confirmed by hashing.
+    """
+    candidates = {}
+    for sub_dir, members in submissions.items():
+        if len(members) == 1:
+            info = members[0][1]
+            candidates.setdefault((info.CRC, info.file_size), []).append(sub_dir)
+    keys = {}
+    for group in candidates.values():
+        if len(group) < 2:
+            continue
+        for sub_dir in group:
+            keys[sub_dir] = zip_member_hash(bulk, submissions[sub_dir][0][1])
+    counts = {}
+    for key in keys.values():
+        counts[key] = counts.get(key, 0) + 1
+    return {sub_dir: key for sub_dir, key in keys.items() if counts[key] > 1}
+
+
+def process_bulk_zip(args, rdir, rename_type, students_map, manifest):
+    """
+    Processes Moodle's "Download all submissions" zip directly: the entries
+    are read as streams and written to their final (renamed / extracted /
+    flattened) paths inside rdir.
+    """
+    max_size = args.max_size * 1024 * 1024 if args.max_size else 0
+    with zipfile.ZipFile(args.from_zip) as bulk:
+        # group the entries by submission directory
+        submissions = {}
+        for info in bulk.infolist():
+            parts = safe_member_path(info.filename)
+            if info.is_dir():
+                continue
+            if not parts or len(parts) < 2:
+                print("IGNORE '{}' (not inside a submission directory)".format(info.filename))
+                continue
+            submissions.setdefault(parts[0], []).append((parts[1:], info))
+
+        dup_keys = zip_duplicate_keys(bulk, submissions) if args.dedup else {}
+        # content key -> [new names], the first one holding the extracted files
+        dup_groups = {}
+        used_names = set()
+        for sub_dir, members in submissions.items():
+            signature = zip_members_signature(members)
+            entry = manifest.get(sub_dir)
+            if (entry and entry.get("signature") == signature and entry.get("status") != "failed"
+                    and os.path.exists(os.path.join(rdir, entry["new_name"]))):
+                print("SKIP '{}' (unchanged, already processed)".format(sub_dir))
+                continue
+            new_name = submission_new_name(sub_dir, rename_type, students_map)
+            if new_name:
+                print("Renaming '{}' to '{}'".format(sub_dir, new_name))
+            else:
+                print("NOT renaming '{}'".format(sub_dir))
+                new_name = sub_dir
+            dest_dir = os.path.join(rdir, new_name)
+            if new_name in used_names:
+                print("NOT extracting '{}' ('{}' already exists)".format(sub_dir, new_name))
+                continue
+            if os.path.exists(dest_dir):
+                if manifest.find_by_new_name(new_name) != sub_dir:
+                    print("NOT extracting '{}' ('{}' already exists)".format(sub_dir, new_name))
+                    continue
+                # changed (e.g., late) submission: replace the old one
+                if not args.dry_run:
+                    keep_previous(dest_dir)
+            used_names.add(new_name)
+            extract = (args.extract and len(members) == 1 and is_archive(members[0][0][-1]))
+            dup_key = dup_keys.get(sub_dir)
+            if dup_key and dup_key in dup_groups:
+                # identical to an already extracted submission: link its files
+                group = dup_groups[dup_key]
+                print("LINK: '{}' (identical to '{}')".format(new_name, group[0]))
+                group.append(new_name)
+                if not args.dry_run:
+                    link_tree(os.path.join(rdir, group[0]), dest_dir)
+                    manifest.record(sub_dir, new_name=new_name, signature=signature,
+                                    status=("extracted" if extract else "copied"),
+                                    duplicate_of=group[0])
+                continue
+            if extract:
+                print("unzip: '{}'".format(os.path.join(dest_dir, members[0][0][-1])))
+            if args.dry_run:
+                if dup_key:
+                    dup_groups[dup_key] = [new_name]
+                continue
+            limits = ExtractLimits(max_size, args.max_files)
+            status = "failed"
+            try:
+                if extract:
+                    with bulk.open(members[0][1]) as src:
+                        extract_nested_archive(src, members[0][0][-1], dest_dir, limits)
+                else:
+                    extract_entries([(parts, info.file_size, lambda info=info: bulk.open(info))
+                                     for parts, info in members], dest_dir, limits)
+                status = "extracted" if extract else "copied"
+            except SubmissionLimitError as e:
+                print("LIMIT: '{}' skipped: {}".format(sub_dir, e))
+                shutil.rmtree(dest_dir, ignore_errors=True)
+            except:
+                traceback.print_exc()
+                if extract:
+                    # keep the original archive (like the directory mode), for inspection
+                    shutil.rmtree(dest_dir, ignore_errors=True)
+                    archive_path = os.path.join(dest_dir, members[0][0][-1])
+                    print("unzip: FAILED, keeping '{}'".format(archive_path))
+                    try:
+                        with bulk.open(members[0][1]) as src:
+                            copy_limited(src, archive_path, ExtractLimits(max_size, args.max_files))
+                    except SubmissionLimitError as e:
+                        print("LIMIT: '{}' skipped: {}".format(sub_dir, e))
+                        shutil.rmtree(dest_dir, ignore_errors=True)
+            manifest.record(sub_dir, new_name=new_name, signature=signature, status=status)
+            if dup_key and status != "failed":
+                dup_groups[dup_key] = [new_name]
+        print_duplicates_report(dup_groups.values())
+
+
 def main(args):
     rdir = args.directory
 
-    if not os.path.isdir(rdir):
+    if args.from_zip and not args.dry_run:
+        os.makedirs(rdir, exist_ok=True)
+    if not os.path.isdir(rdir) and not (args.from_zip and args.dry_run):
         print("Invalid directory: '{}'".format(rdir))
         sys.exit(1)
 
@@ -108,61 +577,126 @@ def main(args):
     if rename_type == 'email' and not students_map:
         raise Exception("Cannot rename with emails without a grading worksheet!")
 
+    manifest = Manifest(rdir, dry_run=args.dry_run)
+    if args.from_zip:
+        process_bulk_zip(args, rdir, rename_type, students_map, manifest)
+    else:
+        process_directory(args, rdir, rename_type, students_map, manifest)
+
+
+def process_directory(args, rdir, rename_type, students_map, manifest):
+    """
+    Renames / extracts the submission directories (already unpacked from the
+    Moodle zip) inside rdir, skipping the ones recorded as done in the manifest.
+    """
     # iterate through all directories and rename / extract them
-    sub_dirs = os.listdir(rdir)
+    # (with multiple jobs or deduplication, extraction is deferred)
+    extract_jobs = []
+    # the new (not yet renamed) directories go first, as they may replace
+    # already renamed ones (which must then not be processed again)
+    sub_dirs = sorted(os.listdir(rdir), key=lambda name: manifest.find_by_new_name(name) is not None)
+    handled = set()  # the (new) names processed by this run
     for sub_dir in sub_dirs:
         full_path = os.path.join(rdir, sub_dir)
-        if not os.path.isdir(full_path):
-            continue
-        norm_name = strip_accents(sub_dir)
-        re_matches = submission_dir_re.match(norm_name)
-        if re_matches:
-            new_name = None
-            student_obj = search_moodle_username(re_matches.group("id"), students_map)
-            email = None
-            if student_obj:
-                email = student_obj["email"]
-            if rename_type in ("email", "username"):
-                if email:
-                    if rename_type == "username":
-                        email = re.sub(r'@\S+$', '', email)
-                    new_name = email
-            elif rename_type == "fname":
-                # rename to  first_name + last_name
-                new_name = re_matches["fname"] + " " + re_matches["lname"]
-            elif rename_type == "fname_user":
-                # rename to  first_name + last_name + (username)
-                new_name = re_matches["fname"] + " " + re_matches["lname"]
-                if email:
-                    email = re.sub(r'@\S+$', '', email)
-                    new_name += " (" + email + ")"
+        if not os.path.isdir(full_path) or sub_dir.endswith(".prev") or sub_dir in handled:
+            continue  # (also skips the previous versions, see keep_previous)
+        original = manifest.find_by_new_name(sub_dir)
+        if original:
+            # already renamed by a previous run
+            status = manifest.get(original).get("status")
+            if status in ("extracted", "ignored") or not args.extract:
+                print("SKIP '{}' (already processed)".format(sub_dir))
+                continue
+        else:
+            original = sub_dir
+            signature = dir_signature(full_path)
+            entry = manifest.get(sub_dir)
+            if (entry and entry.get("signature") == signature and
+                    os.path.isdir(os.path.join(rdir, entry["new_name"]))):
+                # an identical copy (e.g., the bulk zip was unpacked again): remove it,
+                # so it is neither shown to graders nor hashed again by later runs
+                print("REMOVE '{}' (unchanged, already processed as '{}')".format(
+                    sub_dir, entry["new_name"]))
+                if not args.dry_run:
+                    shutil.rmtree(full_path)
+                continue
+            new_name = submission_new_name(sub_dir, rename_type, students_map)
             if new_name:
                 print("Renaming '{}' to '{}'".format(sub_dir, new_name))
                 if not args.dry_run:
                     new_path = os.path.join(rdir, new_name)
+                    if entry and os.path.isdir(new_path):
+                        # changed (e.g., late) submission: replace the old one
+                        keep_previous(new_path)
                     os.rename(full_path, new_path)
                     full_path = new_path
-            if not new_name:
+            else:
                 print("NOT renaming '{}'".format(sub_dir))
-        else:
-            print("NOT renaming '{}'".format(sub_dir))
+            manifest.record(sub_dir, new_name=(new_name or sub_dir), signature=signature,
+                            status="renamed")
+            handled.add(new_name or sub_dir)
         if args.extract:
             # find archive file
             subdir_files = os.listdir(full_path)
             if len(subdir_files) != 1:
                 print("unzip: IGNORE '{}' (multiple files found)".format(sub_dir))
+                manifest.record(original, status="ignored")
                 continue
             archive_file = os.path.join(full_path, subdir_files[0])
             _, archive_ext = os.path.splitext(archive_file)
             if not archive_ext[1:]:
                 print("unzip: IGNORE '{}' (not an archive)".format(archive_file))
+                manifest.record(original, status="ignored")
+                continue
+            if args.dedup or (args.jobs > 1 and not args.dry_run):
+                extract_jobs.append((archive_file, full_path, original))
                 continue
             print("unzip: '{}'".format(archive_file))
             if not args.dry_run:
                 try:
                     extract_archive(archive_file, full_path)
+                    manifest.record(original, status="extracted")
                 except:
                     traceback.print_exc()
+                    manifest.record(original, status="failed")
+    if args.dedup and extract_jobs:
+        extract_deduplicated(extract_jobs, args, manifest)
+    elif extract_jobs:
+        run_extract_jobs(extract_jobs, args.jobs, on_done=lambda original, success: manifest.record(
+            original, status=("extracted" if success else "failed")))
+
+
+def extract_deduplicated(jobs, args, manifest):
+    """
+    Extracts the archives having identical contents only once, hard-linking
+    the extracted files into the other submissions' directories.
+    """
+    hashes = hash_files([archive_file for archive_file, _, _ in jobs], args.jobs)
+    groups = {}
+    for job in jobs:
+        groups.setdefault(hashes[job[0]], []).append(job)
+    # primary submission -> its identical copies
+    duplicates = {group[0][2]: group for group in groups.values()}
+    print_duplicates_report([[os.path.basename(dest_dir) for _, dest_dir, _ in group]
+                             for group in groups.values()])
+    if args.dry_run:
+        for group in groups.values():
+            print("unzip: '{}'".format(group[0][0]))
+        return
+
+    def on_extracted(original, success):
+        group = duplicates[original]
+        primary_dir = group[0][1]
+        manifest.record(original, status=("extracted" if success else "failed"))
+        for archive_file, dest_dir, dup_original in group[1:]:
+            if success:
+                os.remove(archive_file)
+                link_tree(primary_dir, dest_dir)
+                print("unzip: LINK '{}' (identical to '{}')".format(archive_file, primary_dir))
+            manifest.record(dup_original, status=("extracted" if success else "failed"),
+                            duplicate_of=os.path.basename(primary_dir))
+
+    run_extract_jobs([group[0] for group in groups.values()], args.jobs, on_done=on_extracted)
 
 
 if __name__ == "__main__":
@@ -175,6 +709,18 @@ if __name__ == "__main__":
         help="Rename directories using the given method " +
         "(default is 'fname', 'email' if --sheet is given)")
     parser.add_argument("--dry-run", "-n", action='store_true', help="Do a dry run (take no disk actions)")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="Number of archives to extract in parallel (default: 1)")
+    parser.add_argument("--dedup", "-d", action='store_true',
+                        help="Extract identical submission archives only once (the other copies " +
+                        "get hard links to the same files) and report the duplicate groups")
+    parser.add_argument("--from-zip", "-z",
+                        help="Read the submissions straight from Moodle's bulk download zip " +
+                        "(the directory is then the destination)")
+    parser.add_argument("--max-size", type=int, default=512,
+                        help="Max. extracted size of a submission (MB, --from-zip only, default: 512)")
+    parser.add_argument("--max-files", type=int, default=10000,
+                        help="Max. number of files of a submission (--from-zip only, default: 10000)")
     parser.add_argument("directory", help="The submissions directory.")
     args = parser.parse_args()
     main(args)